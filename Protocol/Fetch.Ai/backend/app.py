@@ -7,7 +7,6 @@ import sys
 from mnemonic import Mnemonic
 import numpy as np
 from web3 import Web3
-from web3.exceptions import ContractLogicError
 import requests
 from pymongo import MongoClient
 from dotenv import load_dotenv
@@ -86,6 +85,15 @@ except ImportError:
     ECHONET_STAKING_CONTRACT_ADDRESS = "contract_address"
     CONTRACT_OWNER_PRIVATE_KEY = ""
 
+from backend.registry_cache import RegistryCache
+from backend.slash_queue import SlashQueue
+from backend.chain_cache import BlockClock, ContractReads, GasPriceOracle
+
+# --- Registry Cache ---
+# Every registry read is served from this snapshot; MongoDB is only scanned once at startup.
+REGISTRY_POLL_INTERVAL = float(os.getenv('REGISTRY_POLL_INTERVAL', '5'))
+registry_cache = RegistryCache(sensor_collection, INITIAL_SENSOR_DATA, poll_interval=REGISTRY_POLL_INTERVAL)
+
 app = Flask(__name__)
 
 # Template folder configuration
@@ -119,6 +127,26 @@ else:
     staking_contract = None
     owner_account = None
 
+# --- Slash Transaction Queue ---
+# Slashes are sent by one background worker with locally assigned nonces; the API only enqueues.
+# Reports for a device with a pending (or recently finished) slash join that job.
+SLASH_COALESCE_WINDOW = float(os.getenv('SLASH_COALESCE_WINDOW', '300'))
+SLASH_BATCH_WINDOW = float(os.getenv('SLASH_BATCH_WINDOW', '2'))
+# Contract reads are cached per block; gas price is sampled once per block
+CONTRACT_READ_TTL = float(os.getenv('CONTRACT_READ_TTL', '60'))
+GAS_PRICE_FALLBACK_GWEI = float(os.getenv('GAS_PRICE_FALLBACK_GWEI', '50'))
+GAS_PRICE_MAX_GWEI = float(os.getenv('GAS_PRICE_MAX_GWEI', '500'))
+if BLOCKCHAIN_AVAILABLE:
+    block_clock = BlockClock(w3)
+    contract_reads = ContractReads(staking_contract, block_clock, ttl=CONTRACT_READ_TTL)
+    gas_oracle = GasPriceOracle(w3, block_clock, fallback_gwei=GAS_PRICE_FALLBACK_GWEI, max_gwei=GAS_PRICE_MAX_GWEI)
+    slash_queue = SlashQueue(
+        w3, staking_contract, owner_account, CONTRACT_OWNER_PRIVATE_KEY, contract_reads, gas_oracle, block_clock,
+        coalesce_window=SLASH_COALESCE_WINDOW, batch_window=SLASH_BATCH_WINDOW
+    )
+else:
+    block_clock = contract_reads = gas_oracle = slash_queue = None
+
 # --- MongoDB Database Functions ---
 
 def init_mongodb_with_existing_data():
@@ -156,32 +184,8 @@ def init_mongodb_with_existing_data():
         print(f"❌ Error initializing MongoDB: {e}")
 
 def read_registry():
-    """Reads sensor registry from MongoDB and returns in the exact same format as before."""
-    if not MONGODB_AVAILABLE:
-        # Fallback to initial data
-        return clean_null_values(INITIAL_SENSOR_DATA)
-    
-    try:
-        # Fetch all sensors from MongoDB
-        sensors = sensor_collection.find({})
-        registry = {}
-        
-        for sensor in sensors:
-            mac_address = sensor.get('_id') or sensor.get('mac_address')
-            if mac_address:
-                # Remove MongoDB-specific fields and keep only the original sensor data
-                sensor_data = {k: v for k, v in sensor.items() 
-                             if k not in ['_id', 'created_at', 'updated_at', 'mac_address']}
-                registry[mac_address] = sensor_data
-        
-        # Clean null values and return in exact same format
-        cleaned_registry = clean_null_values(registry)
-        return cleaned_registry if cleaned_registry else {}
-        
-    except Exception as e:
-        print(f"❌ Error reading from MongoDB: {e}")
-        # Fallback to initial data
-        return clean_null_values(INITIAL_SENSOR_DATA)
+    """Returns the sensor registry snapshot in the exact same format as before (served from memory)."""
+    return registry_cache.get_registry()
 
 def write_sensor_to_registry(mac_address, sensor_data):
     """Writes a single sensor to MongoDB."""
@@ -205,6 +209,7 @@ def write_sensor_to_registry(mac_address, sensor_data):
             upsert=True
         )
         
+        registry_cache.upsert(mac_address, sensor_data)
         print(f"✅ Sensor {mac_address} saved to MongoDB")
         return True
         
@@ -222,6 +227,7 @@ def delete_sensor_from_registry(mac_address):
         result = sensor_collection.delete_one({"_id": mac_address})
         
         if result.deleted_count > 0:
+            registry_cache.remove(mac_address)
             print(f"✅ Sensor {mac_address} deleted from MongoDB")
             return True
         else:
@@ -234,31 +240,7 @@ def delete_sensor_from_registry(mac_address):
 
 def get_existing_locations():
     """Get all existing locations from the registry for ID reuse."""
-    registry = read_registry()
-    existing_locations = {}
-    
-    for k, v in registry.items():
-        if k is not None and not k.startswith('_') and v is not None and isinstance(v, dict):
-            if 'name' in v and 'loc_id' in v and v['name'] is not None and v['loc_id'] is not None:
-                existing_locations[v['name']] = v['loc_id']
-    
-    return existing_locations
-
-def clean_null_values(data):
-    """Recursively removes null/None values from dictionaries and lists."""
-    if isinstance(data, dict):
-        cleaned = {}
-        for key, value in data.items():
-            if key is not None and value is not None:
-                cleaned_value = clean_null_values(value)
-                if cleaned_value is not None:
-                    cleaned[key] = cleaned_value
-        return cleaned if cleaned else None
-    elif isinstance(data, list):
-        cleaned = [clean_null_values(item) for item in data if item is not None]
-        return [item for item in cleaned if item is not None] if cleaned else None
-    else:
-        return data if data is not None else None
+    return registry_cache.get_locations()
 
 # --- Flask Routes ---
 
@@ -349,19 +331,79 @@ def register_sensor():
         print(f"[API] Registration error: {e}")
         return jsonify({"status": "error", "message": f"Registration failed: {str(e)}"}), 500
 
+def registry_response_body():
+    """Serializes the registry once per version so repeated polls skip re-encoding."""
+    global _registry_body
+    version, registry = registry_cache.snapshot()
+    cached = _registry_body
+    if cached[0] != version:
+        cached = _registry_body = (version, app.json.dumps(registry))
+    return cached
+
+_registry_body = (None, None)
+
 @app.route('/registry', methods=['GET'])
 def get_registry():
-    """Returns the sensor registry in the exact same format as before."""
+    """Returns the sensor registry in the exact same format as before, with a strong ETag."""
     try:
-        registry = read_registry()
-        
-        # Return the registry in the exact same format as your current response
-        return jsonify(registry)
+        version, body = registry_response_body()
+        etag = registry_cache.etag_for(version)
+
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            # Return the registry in the exact same format as your current response
+            response = app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['X-Registry-Version'] = str(version)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
         
     except Exception as e:
         print(f"[API] Registry error: {e}")
         return jsonify({"status": "error", "message": f"Failed to fetch registry: {str(e)}"}), 500
 
+@app.route('/registry/changes', methods=['GET'])
+def get_registry_changes():
+    """
+    Returns only the MACs added, modified or removed after ?since=<version>.
+    If the version is unknown (another epoch, or older than the retained history),
+    the full registry is returned with "reset": true.
+    """
+    try:
+        since = request.args.get('since', type=int)
+        if since is None:
+            return jsonify({"status": "error", "message": "Query parameter 'since' must be an integer version."}), 400
+        epoch = request.args.get('epoch')
+
+        changes = None
+        if epoch is None or epoch == registry_cache.epoch:
+            changes = registry_cache.changes_since(since)
+
+        if changes is None:
+            version, registry = registry_cache.snapshot()
+            response = {"epoch": registry_cache.epoch, "version": version, "since": since, "reset": True, "registry": registry}
+        else:
+            response = {"epoch": registry_cache.epoch, "since": since, "reset": False, **changes}
+        return jsonify(response)
+
+    except Exception as e:
+        print(f"[API] Registry changes error: {e}")
+        return jsonify({"status": "error", "message": f"Failed to fetch registry changes: {str(e)}"}), 500
+
+@app.route('/registry/<mac_address>', methods=['GET'])
+def get_registry_entry(mac_address):
+    """Returns one sensor's registry entry, so clients can resolve a single unknown MAC cheaply."""
+    try:
+        entry = registry_cache.get(mac_address)
+        if entry is None:
+            return jsonify({"status": "error", "message": "MAC address not found in registry."}), 404
+        return jsonify(entry)
+
+    except Exception as e:
+        print(f"[API] Registry entry error: {e}")
+        return jsonify({"status": "error", "message": f"Failed to fetch registry entry: {str(e)}"}), 500
+
 @app.route('/deregister', methods=['POST'])
 def deregister_sensor():
     """Deregisters a sensor by removing it from MongoDB."""
@@ -408,6 +450,9 @@ def get_database_stats():
             "mongodb_available": MONGODB_AVAILABLE,
             "database_name": MONGODB_DATABASE,
             "collection_name": MONGODB_COLLECTION,
+            "registry_version": registry_cache.version,
+            "slash_queue": slash_queue.stats() if slash_queue else None,
+            "contract_reads": contract_reads.stats() if contract_reads else None,
             "timestamp": datetime.utcnow().isoformat()
         }
         
@@ -435,7 +480,7 @@ def get_database_stats():
 
 @app.route('/request-slash', methods=['POST'])
 def request_slash():
-    """Handles blockchain slashing requests."""
+    """Queues a blockchain slashing request and returns its job id immediately."""
     if not BLOCKCHAIN_AVAILABLE:
         return jsonify({
             "status": "error", 
@@ -449,60 +494,31 @@ def request_slash():
     if not mac_address:
         return jsonify({"status": "error", "message": "MAC address is required."}), 400
 
-    try:
-        normalized_id = mac_address
-        print(f"[API] Normalized deviceId for contract: {normalized_id}")
-
-        contract_owner = staking_contract.functions.owner().call()
-        print(f"[API] Contract owner: {contract_owner}")
-        print(f"[API] Transaction sender: {owner_account.address}")
-
-        # Preflight simulation
-        try:
-            staking_contract.functions.slashStake(normalized_id).call({
-                'from': owner_account.address
-            })
-            print("[API] Preflight simulation SUCCESS")
-        except ContractLogicError as e:
-            print(f"[API] Preflight revert: {e}")
-            return jsonify({
-                "status": "error",
-                "message": f"Simulation failed: {e}",
-                "device_id": normalized_id
-            }), 400
-
-        # Build and send transaction
-        tx = staking_contract.functions.slashStake(normalized_id).build_transaction({
-            'from': owner_account.address,
-            'nonce': w3.eth.get_transaction_count(owner_account.address),
-            'gas': 300000,
-            'gasPrice': w3.to_wei('50', 'gwei'),
-        })
-
-        signed_tx = w3.eth.account.sign_transaction(tx, private_key=CONTRACT_OWNER_PRIVATE_KEY)
-        tx_hash = w3.eth.send_raw_transaction(signed_tx.raw_transaction)
-        print(f"[API] Transaction hash: {tx_hash.hex()}")
-
-        receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
-
-        if receipt.status == 0:
-            return jsonify({
-                "status": "error",
-                "message": "Transaction reverted on-chain",
-                "tx_hash": tx_hash.hex(),
-                "device_id": normalized_id
-            }), 400
-
-        return jsonify({
-            "status": "success",
-            "message": "Slash transaction confirmed",
-            "tx_hash": tx_hash.hex(),
-            "device_id": normalized_id
-        })
-
-    except Exception as e:
-        print(f"[API] Slash error: {e}")
-        return jsonify({"status": "error", "message": str(e)}), 500
+    job, coalesced = slash_queue.submit(mac_address)
+    if coalesced:
+        print(f"[API] Slash for {mac_address} joined job {job['job_id']} ({job['reporters']} reporters)")
+    else:
+        print(f"[API] Slash for {mac_address} queued as job {job['job_id']}")
+    return jsonify({
+        "status": job['status'] if coalesced else "queued",
+        "message": "Slash already requested for this device" if coalesced else "Slash request queued",
+        "job_id": job['job_id'],
+        "device_id": mac_address,
+        "coalesced": coalesced,
+        "reporters": job['reporters'],
+        "tx_hash": job['tx_hash'],
+        "status_url": f"/request-slash/{job['job_id']}"
+    }), 202
+
+@app.route('/request-slash/<job_id>', methods=['GET'])
+def get_slash_job(job_id):
+    """Reports the state of a queued slash: queued, submitted, confirmed, reverted, failed or unconfirmed."""
+    if not BLOCKCHAIN_AVAILABLE:
+        return jsonify({"status": "error", "message": "Blockchain connection not available"}), 503
+    job = slash_queue.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Unknown slash job {job_id}"}), 404
+    return jsonify(job)
 
 # --- Application Initialization ---
 
@@ -0,0 +1,111 @@
+import threading
+import time
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+
+class BlockClock:
+    """Latest block number, asked of the node at most once per `min_interval` seconds."""
+
+    def __init__(self, w3, min_interval=1.0):
+        self.w3 = w3
+        self.min_interval = min_interval
+        self._block = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def current(self):
+        with self._lock:
+            if self._block is None or time.monotonic() - self._checked_at >= self.min_interval:
+                self._block = self.w3.eth.block_number
+                self._checked_at = time.monotonic()
+            return self._block
+
+
+class ContractReads:
+    """
+    Cached view calls on the staking contract.
+
+    Each entry remembers the block it was read at. Entries marked per_block are refetched
+    once a new block arrives (state can only change in a block); all entries also expire
+    after `ttl` seconds. The owner never changes without a transaction, so it is TTL-only.
+    """
+
+    def __init__(self, contract, clock, ttl=60.0, owner_ttl=3600.0):
+        self.contract = contract
+        self.clock = clock
+        self.ttl = ttl
+        self.owner_ttl = owner_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, key, fetch, ttl, per_block):
+        block = self.clock.current() if per_block else None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[2] < ttl and (not per_block or entry[1] == block):
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        value = fetch()
+        with self._lock:
+            self._entries[key] = (value, block, now)
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def owner(self):
+        return self._cached('owner', self.contract.functions.owner().call, self.owner_ttl, per_block=False)
+
+    def device_owner(self, device_id):
+        """Address that staked `device_id`, or ZERO_ADDRESS if the device has no stake."""
+        return self._cached(('device_owner', device_id),
+                            self.contract.functions.deviceIdToOwner(device_id).call, self.ttl, per_block=True)
+
+    def is_staked(self, device_id):
+        return self.device_owner(device_id) != ZERO_ADDRESS
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class GasPriceOracle:
+    """
+    Gas price sampled from the node once per block, scaled by `multiplier` and capped at
+    `max_gwei`. Falls back to `fallback_gwei` when the node cannot be asked.
+    """
+
+    def __init__(self, w3, clock, fallback_gwei=50, multiplier=1.1, max_gwei=500):
+        self.w3 = w3
+        self.clock = clock
+        self.fallback_wei = w3.to_wei(fallback_gwei, 'gwei')
+        self.multiplier = multiplier
+        self.max_wei = w3.to_wei(max_gwei, 'gwei')
+        self._sample = None
+        self._lock = threading.Lock()
+
+    def price(self):
+        try:
+            block = self.clock.current()
+        except Exception as e:
+            print(f"[GasPriceOracle] Block number unavailable ({e}); using fallback gas price")
+            return self.fallback_wei
+        with self._lock:
+            if self._sample is not None and self._sample[0] == block:
+                return self._sample[1]
+        try:
+            price = min(int(self.w3.eth.gas_price * self.multiplier), self.max_wei)
+        except Exception as e:
+            print(f"[GasPriceOracle] Gas price unavailable ({e}); using fallback gas price")
+            return self._sample[1] if self._sample is not None else self.fallback_wei
+        with self._lock:
+            self._sample = (block, price)
+        return price
@@ -0,0 +1,294 @@
+import secrets
+import threading
+import time
+from collections import deque
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+# Fields added by the backend that are never part of the public registry format
+MONGO_META_FIELDS = ('_id', 'created_at', 'updated_at', 'mac_address')
+
+# Server error code for "$changeStream is only supported on replica sets"
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+
+def clean_null_values(data):
+    """Recursively removes null/None values from dictionaries and lists."""
+    if isinstance(data, dict):
+        cleaned = {}
+        for key, value in data.items():
+            if key is not None and value is not None:
+                cleaned_value = clean_null_values(value)
+                if cleaned_value is not None:
+                    cleaned[key] = cleaned_value
+        return cleaned if cleaned else None
+    elif isinstance(data, list):
+        cleaned = [clean_null_values(item) for item in data if item is not None]
+        return [item for item in cleaned if item is not None] if cleaned else None
+    else:
+        return data if data is not None else None
+
+
+def document_to_entry(document):
+    """Converts a MongoDB sensor document into a (mac_address, sensor_data) registry entry."""
+    mac_address = document.get('_id') or document.get('mac_address')
+    if not mac_address:
+        return None, None
+    sensor_data = {k: v for k, v in document.items() if k not in MONGO_META_FIELDS}
+    return mac_address, clean_null_values(sensor_data)
+
+
+class RegistryCache:
+    """
+    Versioned in-memory snapshot of the sensor registry.
+
+    The collection is scanned once; afterwards the snapshot is kept current by the
+    backend's own write paths and by a MongoDB change stream (or a cheap polling
+    fallback when change streams are unsupported) for writes made by other backend
+    instances. Readers get an immutable dict that is swapped atomically, so serving
+    `/registry` never touches the database.
+
+    Every change is also recorded in a bounded log of (version, mac, kind) so clients
+    can ask for only what changed since the version they already hold.
+    """
+
+    def __init__(self, collection, fallback_data, poll_interval=5.0, history_size=10000, max_watch_backoff=300.0):
+        self.collection = collection
+        self.fallback_data = fallback_data
+        self.poll_interval = poll_interval
+        self.max_watch_backoff = max_watch_backoff
+        # Versions restart with the process, so the epoch tells clients which counter they hold
+        self.epoch = secrets.token_hex(4)
+        self.version = 0
+        self._changes = deque(maxlen=history_size)
+        # Changes at or below this version may have been evicted from the log
+        self._history_floor = 0
+        self._registry = {}
+        self._locations = None
+        self._write_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._started = False
+        self._watcher = None
+        # Both taken just before the last full scan, so nothing written during it is missed
+        self._poll_signature = None
+        self._scan_cluster_time = None
+
+    # --- Reads ---
+
+    def get_registry(self):
+        """Returns the current registry snapshot. Callers must not mutate it."""
+        self._ensure_started()
+        return self._registry
+
+    def snapshot(self):
+        """Returns (version, registry) read atomically."""
+        self._ensure_started()
+        with self._write_lock:
+            return self.version, self._registry
+
+    def get(self, mac_address):
+        self._ensure_started()
+        return self._registry.get(mac_address)
+
+    def etag_for(self, version):
+        """Strong ETag for the snapshot at `version`."""
+        return f"{self.epoch}-{version}"
+
+    def changes_since(self, since):
+        """
+        Returns {"version": ..., "added": {...}, "modified": {...}, "removed": [...]} for everything that
+        changed after `since`, or None if that version is older than the retained history.
+        """
+        self._ensure_started()
+        with self._write_lock:
+            version, registry = self.version, self._registry
+            if since > version or since < self._history_floor:
+                return None
+            first_kind = {}
+            for change_version, mac_address, kind in self._changes:
+                if change_version > since and mac_address not in first_kind:
+                    first_kind[mac_address] = kind
+
+        added, modified, removed = {}, {}, []
+        for mac_address, kind in first_kind.items():
+            if mac_address not in registry:
+                removed.append(mac_address)
+            elif kind == 'added':
+                added[mac_address] = registry[mac_address]
+            else:
+                modified[mac_address] = registry[mac_address]
+        return {"version": version, "added": added, "modified": modified, "removed": removed}
+
+    def get_locations(self):
+        """Returns {location name: loc_id}, rebuilt at most once per registry version."""
+        self._ensure_started()
+        locations = self._locations
+        if locations is None:
+            locations = {}
+            for k, v in self._registry.items():
+                if k is not None and not k.startswith('_') and v is not None and isinstance(v, dict):
+                    if v.get('name') is not None and v.get('loc_id') is not None:
+                        locations[v['name']] = v['loc_id']
+            self._locations = locations
+        return locations
+
+    # --- Writes ---
+
+    def upsert(self, mac_address, sensor_data):
+        """Applies a successful write to the snapshot. Returns True if the registry changed."""
+        self._ensure_started()
+        return self._apply(mac_address, clean_null_values(sensor_data))
+
+    def remove(self, mac_address):
+        """Applies a successful delete to the snapshot. Returns True if the registry changed."""
+        self._ensure_started()
+        return self._apply(mac_address, None)
+
+    def reload(self):
+        """Rebuilds the snapshot from a full collection scan, bumping the version only on change."""
+        if self.collection is not None:
+            self._scan_cluster_time = self._cluster_time()
+            self._poll_signature = self._signature()
+        registry = self._scan()
+        with self._write_lock:
+            if registry != self._registry or self.version == 0:
+                changes = [(mac, 'removed') for mac in self._registry if mac not in registry]
+                for mac, sensor_data in registry.items():
+                    if mac not in self._registry:
+                        changes.append((mac, 'added'))
+                    elif self._registry[mac] != sensor_data:
+                        changes.append((mac, 'modified'))
+                self._publish(registry, changes)
+                print(f"🔄 Registry cache loaded {len(registry)} entries (version {self.version})")
+
+    # --- Internals ---
+
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            self.reload()
+            if self.collection is not None:
+                self._watcher = threading.Thread(target=self._watch, name="registry-cache-watcher", daemon=True)
+                self._watcher.start()
+            self._started = True
+
+    def _scan(self):
+        if self.collection is None:
+            return clean_null_values(self.fallback_data) or {}
+        try:
+            registry = {}
+            for document in self.collection.find({}):
+                mac_address, sensor_data = document_to_entry(document)
+                if mac_address and sensor_data is not None:
+                    registry[mac_address] = sensor_data
+            return registry
+        except PyMongoError as e:
+            print(f"❌ Error reading from MongoDB: {e}")
+            if self._registry:
+                return self._registry
+            return clean_null_values(self.fallback_data) or {}
+
+    def _apply(self, mac_address, sensor_data):
+        with self._write_lock:
+            current = self._registry.get(mac_address)
+            if current == sensor_data:
+                return False
+            registry = dict(self._registry)
+            if sensor_data is None:
+                registry.pop(mac_address, None)
+                kind = 'removed'
+            else:
+                registry[mac_address] = sensor_data
+                kind = 'added' if current is None else 'modified'
+            self._publish(registry, [(mac_address, kind)])
+            return True
+
+    def _publish(self, registry, changes):
+        # Caller holds _write_lock. Swap in a new dict so in-flight readers keep a consistent view.
+        self._registry = registry
+        self._locations = None
+        self.version += 1
+        for mac_address, kind in changes:
+            if len(self._changes) == self._changes.maxlen:
+                self._history_floor = self._changes[0][0]
+            self._changes.append((self.version, mac_address, kind))
+
+    def _cluster_time(self):
+        # None on standalone servers, which have no change streams to start anyway
+        try:
+            return self.collection.database.client.admin.command('ping').get('operationTime')
+        except PyMongoError:
+            return None
+
+    def _signature(self):
+        # Count catches deletes, newest updated_at catches inserts/updates
+        try:
+            latest = self.collection.find_one({}, {'updated_at': 1}, sort=[('updated_at', -1)])
+            return self.collection.estimated_document_count(), latest and latest.get('updated_at')
+        except PyMongoError as e:
+            print(f"⚠️  Registry poll failed: {e}")
+            return None
+
+    def _watch(self):
+        """
+        Follows the change stream from the cluster time of the last full scan. When the stream
+        fails the registry is polled while the watch is retried with exponential backoff; only
+        a server without change streams at all is polled for good.
+        """
+        backoff = self.poll_interval
+        resume_token = None
+        while True:
+            if resume_token is not None:
+                options = {'resume_after': resume_token}
+            else:
+                options = {'start_at_operation_time': self._scan_cluster_time}
+            try:
+                with self.collection.watch(full_document='updateLookup', **options) as stream:
+                    print("👀 Registry cache following MongoDB change stream")
+                    backoff = self.poll_interval
+                    for change in stream:
+                        self._apply_change(change)
+                        resume_token = stream.resume_token
+                # The stream was invalidated and the registry reloaded: start over from that scan
+                resume_token = None
+                continue
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    print(f"⚠️  Change streams unavailable ({e}); polling registry every {self.poll_interval}s")
+                    self._poll()
+                    return
+                # The resume point may have left the oplog: rescan and follow on from there
+                print(f"⚠️  Registry change stream failed ({e}); retrying in {backoff:g}s")
+                resume_token = None
+                self.reload()
+            except PyMongoError as e:
+                print(f"⚠️  Registry change stream stopped ({e}); retrying in {backoff:g}s")
+            self._poll(until=time.monotonic() + backoff)
+            backoff = min(backoff * 2, self.max_watch_backoff)
+
+    def _apply_change(self, change):
+        operation = change.get('operationType')
+        if operation in ('insert', 'replace', 'update'):
+            document = change.get('fullDocument')
+            if document is None:
+                # The document was deleted before the update lookup ran
+                self._apply(change['documentKey']['_id'], None)
+                return
+            mac_address, sensor_data = document_to_entry(document)
+            if mac_address:
+                self._apply(mac_address, sensor_data)
+        elif operation == 'delete':
+            self._apply(change['documentKey']['_id'], None)
+        elif operation in ('drop', 'rename', 'dropDatabase', 'invalidate'):
+            self.reload()
+
+    def _poll(self, until=None):
+        """Reloads whenever the collection's signature moves; forever, or until `until` (monotonic)."""
+        while until is None or time.monotonic() < until:
+            signature = self._signature()
+            if signature is not None and signature != self._poll_signature:
+                self.reload()
+            time.sleep(self.poll_interval)
@@ -0,0 +1,424 @@
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from web3.exceptions import ContractLogicError, TransactionNotFound
+
+
+
+class NonceManager:
+    """
+    Hands out sequential nonces for one sender without asking the node each time.
+
+    The counter starts from the node's pending transaction count and is only re-read
+    after a send fails, since a failed send leaves a gap that would stall later ones.
+    """
+
+    def __init__(self, w3, address):
+        self.w3 = w3
+        self.address = address
+        self._next = None
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            if self._next is None:
+                self._next = self.w3.eth.get_transaction_count(self.address, 'pending')
+            nonce = self._next
+            self._next += 1
+            return nonce
+
+    def resync(self):
+        with self._lock:
+            self._next = None
+
+    def reset(self, nonce):
+        with self._lock:
+            self._next = nonce
+
+
+class SlashQueue:
+    """
+    Background transaction worker for slash requests.
+
+    Requests are queued and answered with a job id straight away. A single worker thread
+    checks that its signer is the contract owner (slashStake is onlyOwner) and each
+    device's stake (cached per block), signs the slash with the next local nonce and a
+    gas price sampled once per block, sends it, then polls the
+    receipts of everything in flight together once per new block (one JSON-RPC batch
+    when the provider supports it). Job state is kept in memory for the status endpoint.
+
+    Many peers report the same misbehaving device, so requests are coalesced per device:
+    while a device's job is pending, or for `coalesce_window` seconds after it was confirmed,
+    further requests join that job instead of creating a transaction. The worker also
+    waits `batch_window` seconds after the first new job, then signs everything collected
+    and sends it as one JSON-RPC batch, so RPC round trips scale with windows, not reports.
+
+    Nonces never stay stranded: when a send fails or a transaction gets no receipt, every
+    nonce between the node's pending count and the highest one in flight that holds no
+    transaction is filled with a 0-value transfer to ourselves, and an expired slash is
+    re-signed at its nonce with `gas_bump` times the gas price (up to `max_replacements`
+    times, then cancelled with a filler), so later slashes are not stuck behind the gap.
+    """
+
+    def __init__(self, w3, contract, account, private_key, reads, gas_oracle, clock, gas=300000,
+                 poll_interval=2.0, receipt_timeout=600.0, max_jobs=10000,
+                 coalesce_window=300.0, batch_window=2.0, max_replacements=3, gas_bump=1.125):
+        self.w3 = w3
+        self.contract = contract
+        self.account = account
+        self.private_key = private_key
+        self.reads = reads
+        self.gas_oracle = gas_oracle
+        self.clock = clock
+        self.gas = gas
+        self.poll_interval = poll_interval
+        self.receipt_timeout = receipt_timeout
+        self.max_jobs = max_jobs
+        self.coalesce_window = coalesce_window
+        self.batch_window = batch_window
+        self.max_replacements = max_replacements
+        self.gas_bump = gas_bump
+        self.nonces = NonceManager(w3, account.address)
+        self._jobs = OrderedDict()
+        self._job_by_device = {}
+        self._jobs_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._in_flight = {}  # tx_hash -> (job_id, sent_at, gas_price, earlier tx hashes of the job)
+        self._chain_id = None
+        self._last_polled_block = None
+        self._start_lock = threading.Lock()
+        self._worker = None
+
+    # --- API ---
+
+    def submit(self, mac_address):
+        """Queues a slash for `mac_address` (or joins the device's current job). Returns (job dict, coalesced)."""
+        now = time.time()
+        with self._jobs_lock:
+            current = self._jobs.get(self._job_by_device.get(mac_address))
+            # A failed, reverted or unconfirmed job never absorbs a new request
+            if current is not None and (current['status'] in ('queued', 'submitted')
+                                        or (current['status'] == 'confirmed'
+                                            and now - current['updated_at'] < self.coalesce_window)):
+                current['reporters'] += 1
+                return dict(current), True
+            # status: queued -> submitted -> confirmed | reverted, or failed / unconfirmed
+            job = {
+                'job_id': uuid.uuid4().hex,
+                'device_id': mac_address,
+                'status': 'queued',
+                'tx_hash': None,
+                'nonce': None,
+                'error': None,
+                'reporters': 1,
+                'replacements': 0,
+                'created_at': now,
+                'updated_at': now,
+            }
+            self._jobs[job['job_id']] = job
+            self._job_by_device[mac_address] = job['job_id']
+            while len(self._jobs) > self.max_jobs:
+                _, evicted = self._jobs.popitem(last=False)
+                if self._job_by_device.get(evicted['device_id']) == evicted['job_id']:
+                    del self._job_by_device[evicted['device_id']]
+            job = dict(job)
+        self._ensure_started()
+        self._queue.put(job['job_id'])
+        return job, False
+
+    def get(self, job_id):
+        with self._jobs_lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def stats(self):
+        with self._jobs_lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+        return {'queued': self._queue.qsize(), 'in_flight': len(self._in_flight), 'jobs': counts}
+
+    # --- Worker ---
+
+    def _ensure_started(self):
+        if self._worker is not None:
+            return
+        with self._start_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="slash-tx-worker", daemon=True)
+                self._worker.start()
+
+    def _update(self, job_id, **fields):
+        with self._jobs_lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields, updated_at=time.time())
+
+    def _next_jobs(self):
+        # Block until work arrives; while transactions are in flight wake up to poll them
+        try:
+            job_ids = [self._queue.get(timeout=self.poll_interval if self._in_flight else None)]
+        except queue.Empty:
+            return []
+        # Collect everything else that arrives within the batch window
+        deadline = time.monotonic() + self.batch_window
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                job_ids.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                return job_ids
+
+    def _run(self):
+        while True:
+            job_ids = self._next_jobs()
+            if job_ids:
+                try:
+                    self._send_batch(job_ids)
+                except Exception as e:
+                    print(f"[SlashQueue] Batch send failed: {e}")
+                    # A job left 'queued' would absorb every later report for its device
+                    self._fail_queued(job_ids, f"Batch send failed: {e}")
+            if self._in_flight:
+                try:
+                    self._poll_receipts()
+                except Exception as e:
+                    print(f"[SlashQueue] Receipt poll failed: {e}")
+
+    def _fail_queued(self, job_ids, error):
+        with self._jobs_lock:
+            for job_id in job_ids:
+                job = self._jobs.get(job_id)
+                if job is not None and job['status'] == 'queued':
+                    job.update(status='failed', error=error, updated_at=time.time())
+
+    def _batch_request(self, method, params_list):
+        """Sends one JSON-RPC batch; returns the responses in order, or None if batching is unavailable."""
+        make_batch_request = getattr(self.w3.provider, 'make_batch_request', None)
+        if make_batch_request is None or len(params_list) < 2:
+            return None
+        try:
+            responses = make_batch_request([(method, params) for params in params_list])
+        except Exception as e:
+            print(f"[SlashQueue] Batch {method} failed, falling back to single requests: {e}")
+            return None
+        if not isinstance(responses, list) or len(responses) != len(params_list):
+            return None
+        return sorted(responses, key=lambda response: response.get('id', 0))
+
+    def _preflight(self, job_id, device_id, slash, simulate=False):
+        # The cached stake lookup stands in for an eth_call simulation per slash, unless the
+        # signer could not be checked against the contract owner
+        try:
+            staked = self.reads.is_staked(device_id)
+        except Exception as e:
+            print(f"[SlashQueue] Stake lookup failed for {device_id} ({e}); simulating instead")
+        else:
+            if not staked:
+                print(f"[SlashQueue] Preflight: {device_id} has no stake")
+                self._update(job_id, status='failed', error="Simulation failed: DeviceIdNotFound (no active stake)")
+                return False
+            if not simulate:
+                return True
+        try:
+            slash.call({'from': self.account.address})
+            return True
+        except ContractLogicError as e:
+            print(f"[SlashQueue] Preflight revert for {device_id}: {e}")
+            self._update(job_id, status='failed', error=f"Simulation failed: {e}")
+        except Exception as e:
+            print(f"[SlashQueue] Preflight error for {device_id}: {e}")
+            self._update(job_id, status='failed', error=str(e))
+        return False
+
+    def _send_batch(self, job_ids):
+        jobs = [job for job in (self.get(job_id) for job_id in job_ids) if job is not None]
+        if not jobs:
+            return
+        try:
+            contract_owner = self.reads.owner()
+            print(f"[SlashQueue] Sending {len(jobs)} slash(es). Contract owner: {contract_owner}, sender: {self.account.address}")
+        except Exception as e:
+            print(f"[SlashQueue] Could not read contract owner ({e}); simulating each slash")
+            contract_owner = None
+        if contract_owner is not None and contract_owner.lower() != self.account.address.lower():
+            # slashStake is onlyOwner: sending would only pay gas for a revert
+            error = f"Signer {self.account.address} is not the contract owner {contract_owner}"
+            print(f"[SlashQueue] {error}; not sending")
+            self._fail_queued([job['job_id'] for job in jobs], error)
+            return
+
+        gas_price = self.gas_oracle.price()
+        signed = []
+        failed = False
+        for i, job in enumerate(jobs):
+            slash = self.contract.functions.slashStake(job['device_id'])
+            if not self._preflight(job['job_id'], job['device_id'], slash, simulate=contract_owner is None):
+                continue
+            try:
+                tx = slash.build_transaction({'from': self.account.address, 'nonce': 0, 'gas': self.gas, 'gasPrice': gas_price})
+            except Exception as e:
+                self._update(job['job_id'], status='failed', error=str(e))
+                continue
+            # Only a built transaction takes a nonce
+            try:
+                nonce = self.nonces.next()
+            except Exception as e:
+                # Without a nonce nothing else in the window can be signed either
+                print(f"[SlashQueue] Could not read nonce: {e}")
+                self.nonces.resync()
+                self._fail_queued([later['job_id'] for later in jobs[i:]], f"Could not read nonce: {e}")
+                break
+            try:
+                raw = self._sign(dict(tx, nonce=nonce))
+            except Exception as e:
+                failed = True
+                self._update(job['job_id'], status='failed', error=str(e))
+                continue
+            signed.append((job, nonce, raw))
+
+        responses = self._batch_request('eth_sendRawTransaction', [[self.w3.to_hex(raw)] for _, _, raw in signed])
+        for i, (job, nonce, raw) in enumerate(signed):
+            try:
+                if responses is None:
+                    tx_hash = self.w3.to_hex(self.w3.eth.send_raw_transaction(raw))
+                elif 'error' in responses[i]:
+                    raise RuntimeError(responses[i]['error'].get('message', responses[i]['error']))
+                else:
+                    tx_hash = responses[i]['result']
+            except Exception as e:
+                failed = True
+                print(f"[SlashQueue] Send failed for {job['device_id']}: {e}")
+                self._update(job['job_id'], status='failed', error=str(e))
+                continue
+            print(f"[SlashQueue] Slash for {job['device_id']} sent (nonce {nonce}): {tx_hash}")
+            self._in_flight[tx_hash] = (job['job_id'], time.time(), gas_price, ())
+            self._update(job['job_id'], status='submitted', tx_hash=tx_hash, nonce=nonce)
+        if failed:
+            # The failed nonce is a hole that every later transaction would wait behind
+            self._repair_nonces()
+
+    def _sign(self, tx):
+        return self.w3.eth.account.sign_transaction(tx, private_key=self.private_key).raw_transaction
+
+    def _send_filler(self, nonce, gas_price):
+        if self._chain_id is None:
+            self._chain_id = self.w3.eth.chain_id
+        tx = {'to': self.account.address, 'value': 0, 'gas': 21000, 'gasPrice': gas_price,
+              'nonce': nonce, 'chainId': self._chain_id}
+        tx_hash = self.w3.to_hex(self.w3.eth.send_raw_transaction(self._sign(tx)))
+        print(f"[SlashQueue] Filled nonce {nonce} with a 0-value transfer: {tx_hash}")
+
+    def _repair_nonces(self, expired=()):
+        """Replaces expired transactions still holding an open nonce and fills every gap below the highest one in flight."""
+        try:
+            # 'latest' tells which nonces are mined; 'pending' also counts the mempool, and gaps sit above it
+            mined = self.w3.eth.get_transaction_count(self.account.address, 'latest') if expired else 0
+            pending = self.w3.eth.get_transaction_count(self.account.address, 'pending')
+        except Exception as e:
+            print(f"[SlashQueue] Could not read pending nonce ({e}); re-reading it before the next send")
+            self.nonces.resync()
+            return
+        for tx_hash, (job_id, _, gas_price, earlier) in expired:
+            job = self.get(job_id)
+            if job is None:
+                continue
+            if job['nonce'] < mined:
+                # The nonce was used, possibly by an earlier signature of this same slash
+                self._settle_expired(job_id, earlier + (tx_hash,))
+                continue
+            bumped = min(int(gas_price * self.gas_bump), self.gas_oracle.max_wei)
+            try:
+                if job['replacements'] >= self.max_replacements:
+                    self._send_filler(job['nonce'], bumped)
+                    self._update(job_id, status='unconfirmed', error=f"No receipt after {job['replacements']} replacements; cancelled")
+                    continue
+                tx = self.contract.functions.slashStake(job['device_id']).build_transaction({
+                    'from': self.account.address, 'nonce': job['nonce'], 'gas': self.gas, 'gasPrice': bumped})
+                new_hash = self.w3.to_hex(self.w3.eth.send_raw_transaction(self._sign(tx)))
+            except Exception as e:
+                print(f"[SlashQueue] Could not replace slash for {job['device_id']} at nonce {job['nonce']}: {e}")
+                self._update(job_id, status='unconfirmed', error=f"No receipt and replacement failed: {e}")
+                continue
+            print(f"[SlashQueue] Re-sent slash for {job['device_id']} at nonce {job['nonce']} with gas price {bumped}: {new_hash}")
+            self._in_flight[new_hash] = (job_id, time.time(), bumped, earlier + (tx_hash,))
+            self._update(job_id, tx_hash=new_hash, replacements=job['replacements'] + 1)
+
+        used = set()
+        for job_id, *_ in self._in_flight.values():
+            job = self.get(job_id)
+            if job is not None and job['nonce'] is not None:
+                used.add(job['nonce'])
+        highest = max(used, default=pending - 1)
+        gaps = [nonce for nonce in range(pending, highest) if nonce not in used]
+        if gaps:
+            gas_price = self.gas_oracle.price()
+            for nonce in gaps:
+                try:
+                    self._send_filler(nonce, gas_price)
+                except Exception as e:
+                    print(f"[SlashQueue] Could not fill nonce {nonce}: {e}")
+        self.nonces.reset(max(pending, highest + 1))
+
+    def _settle_expired(self, job_id, tx_hashes):
+        for status in self._fetch_receipt_statuses(list(tx_hashes)):
+            if status is not None:
+                self._update(job_id, status='confirmed' if status == 1 else 'reverted',
+                             error=None if status == 1 else "Transaction reverted on-chain")
+                return
+        self._update(job_id, status='unconfirmed', error=f"No receipt after {self.receipt_timeout:.0f}s")
+
+    def _poll_receipts(self):
+        # Receipts only change when a block is added
+        block_number = self.clock.current()
+        if block_number == self._last_polled_block:
+            self._expire_in_flight()
+            return
+        self._last_polled_block = block_number
+
+        tx_hashes = list(self._in_flight)
+        for tx_hash, status in zip(tx_hashes, self._fetch_receipt_statuses(tx_hashes)):
+            if status is None:
+                continue
+            job_id = self._in_flight.pop(tx_hash)[0]
+            if status == 1:
+                self._update(job_id, status='confirmed')
+                job = self.get(job_id)
+                if job is not None:
+                    self.reads.invalidate(('device_owner', job['device_id']))
+            else:
+                self._update(job_id, status='reverted', error="Transaction reverted on-chain")
+        self._expire_in_flight()
+
+    def _fetch_receipt_statuses(self, tx_hashes):
+        """Returns the receipt status (1/0) per hash, or None while it is still pending."""
+        responses = self._batch_request('eth_getTransactionReceipt', [[h] for h in tx_hashes])
+        if responses is not None:
+            return [self._raw_status(response.get('result')) for response in responses]
+        statuses = []
+        for tx_hash in tx_hashes:
+            try:
+                statuses.append(self.w3.eth.get_transaction_receipt(tx_hash)['status'])
+            except TransactionNotFound:
+                statuses.append(None)
+        return statuses
+
+    @staticmethod
+    def _raw_status(receipt):
+        if not receipt:
+            return None
+        status = receipt.get('status')
+        return int(status, 16) if isinstance(status, str) else status
+
+    def _expire_in_flight(self):
+        now = time.time()
+        expired = [(tx_hash, entry) for tx_hash, entry in self._in_flight.items() if now - entry[1] > self.receipt_timeout]
+        if not expired:
+            return
+        for tx_hash, _ in expired:
+            del self._in_flight[tx_hash]
+        # A dropped transaction leaves its nonce open and stalls every later one
+        self._repair_nonces(expired)
@@ -1,6 +1,8 @@
 import sys
 import os
 import re
+import asyncio
+import threading
 import requests
 from datetime import datetime, time
 from uuid import uuid4
@@ -40,40 +42,145 @@ agent = Agent(
 fund_agent_if_low(agent.wallet.address())
 
 # --- Knowledge Base Logic ---
-KNOWLEDGE_GRAPH_RAW_URL = f"https://gist.githubusercontent.com/raw/{KNOWLEDGE_GRAPH_GIST_ID}/knowledge_graph.metta"
+# KNOWLEDGE_GRAPH_RAW_URL can point at a local stand-in serving the Gist's raw files.
+GIST_RAW_BASE_URL = os.getenv("KNOWLEDGE_GRAPH_RAW_URL", f"https://gist.githubusercontent.com/raw/{KNOWLEDGE_GRAPH_GIST_ID}")
+KNOWLEDGE_GRAPH_FILE = "knowledge_graph.metta"
+# Each notary replica publishes its segments with a manifest named knowledge_graph.<replica>.index.json
+KNOWLEDGE_GRAPH_REPLICAS = [r.strip() for r in os.getenv("KNOWLEDGE_GRAPH_REPLICAS", "0").split(",") if r.strip()]
 LOCATIONS_CACHE = {}
 EVENTS_CACHE = []
 
-def load_knowledge_base():
-    global LOCATIONS_CACHE, EVENTS_CACHE
-    print(f"Loading knowledge base from Gist: {KNOWLEDGE_GRAPH_RAW_URL}")
-    try:
-        response = requests.get(KNOWLEDGE_GRAPH_RAW_URL, timeout=10)
-        response.raise_for_status()
-        content = response.text
-        
-        locations = {}
-        events = []
-        for line in content.splitlines():
-            line = line.strip()
-            if not line or line.startswith(";"):
+class KnowledgeBaseSync:
+    """
+    Incremental reader for the append-only knowledge graph.
+
+    For every file it remembers how many bytes have been parsed (complete lines only) and
+    the ETag seen at that point. A sync asks for each replica's manifest with a conditional
+    GET and merges the segments of all replicas that have published one, skips
+    segments the manifest says hold nothing new (so sealed segments are read once), and
+    fetches the rest with a Range request from the parsed offset. The legacy single file
+    is read the same way, with If-None-Match short-circuiting unchanged content. A file
+    that shrank was rewritten rather than appended to, and everything is read again.
+    """
+
+    def __init__(self, base_url: str, replicas: list):
+        self.base_url = base_url
+        self.replicas = replicas
+        self.session = requests.Session()
+        self.mode = None       # "segments" or "legacy"
+        self.manifests = {}    # manifest name -> (ETag, manifest)
+        self.files = {}        # name -> {"offset": bytes parsed, "etag": ETag when fully read}
+        self._lock = threading.Lock()
+
+    def fetch_new(self):
+        """Returns (reset, [text]): the new complete lines, and whether the caches must be rebuilt from them."""
+        with self._lock:
+            segments = self._fetch_manifest()
+            mode = "legacy" if segments is None else "segments"
+            reset = self.mode is not None and mode != self.mode
+            if mode != self.mode:
+                self.mode = mode
+                self.files.clear()
+            chunks = self._read_all(segments)
+            if chunks is None:
+                reset = True
+                self.files.clear()
+                chunks = self._read_all(segments) or []
+            return reset, chunks
+
+    def _fetch_manifest(self):
+        """Segments of every replica that has published a manifest, or None if none has."""
+        segments = None
+        for replica in self.replicas:
+            name = f"knowledge_graph.{replica}.index.json"
+            etag, manifest = self.manifests.get(name, (None, None))
+            response = self.session.get(f"{self.base_url}/{name}", headers={"If-None-Match": etag} if etag else {}, timeout=10)
+            if response.status_code == 404:
+                self.manifests.pop(name, None)
                 continue
+            if response.status_code != 304:
+                response.raise_for_status()
+                manifest = response.json()
+                self.manifests[name] = (response.headers.get("ETag"), manifest)
+            segments = (segments or []) + manifest["segments"]
+        return segments
 
-            loc_match = re.match(r'\(location (\S+) "(.*)" ([\d\.\-]+) ([\d\.\-]+)\)', line)
-            if loc_match:
-                loc_id, name, lat, lon = loc_match.groups()
-                locations[loc_id] = {"name": name, "lat": float(lat), "lon": float(lon)}
+    def _read_all(self, segments):
+        if segments is None:
+            text = self._read(KNOWLEDGE_GRAPH_FILE)
+            return None if text is None else [text]
+        chunks = []
+        for segment in segments:
+            if not segment["bytes"]:
+                continue
+            text = self._read(segment["name"], segment["bytes"])
+            if text is None:
+                return None
+            chunks.append(text)
+        return chunks
 
-            event_match = re.match(r'\(noise_event (\S+) (\S+) "([^"]+)" (\d+\.?\d*)\)', line)
-            if event_match:
-                _, loc_id, timestamp, db = event_match.groups()
-                events.append({"loc_id": loc_id, "timestamp": timestamp, "db": float(db)})
+    def _read(self, name: str, known_size: int = None):
+        """New complete lines of `name` past the parsed offset, or None if the file shrank."""
+        state = self.files.setdefault(name, {"offset": 0, "etag": None})
+        offset = state["offset"]
+        if known_size is not None and known_size <= offset:
+            return ""
+        headers = {"If-None-Match": state["etag"]} if state["etag"] else {}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        response = self.session.get(f"{self.base_url}/{name}", headers=headers, timeout=10)
+        if response.status_code == 304:
+            return ""
+        if response.status_code == 416:
+            total = response.headers.get("Content-Range", "").rpartition("/")[2]
+            return None if total.isdigit() and int(total) < offset else ""
+        response.raise_for_status()
+        data = response.content
+        if response.status_code == 200 and offset:
+            # The server ignored the Range header and sent the whole file
+            if len(data) < offset:
+                return None
+            data = data[offset:]
+        # A trailing partial line is left for the next sync to fetch again
+        complete = data[:data.rfind(b"\n") + 1]
+        state["offset"] = offset + len(complete)
+        state["etag"] = response.headers.get("ETag") if len(complete) == len(data) else None
+        return complete.decode("utf-8")
 
-        LOCATIONS_CACHE = locations
-        EVENTS_CACHE = events
-        print(f"Loaded {len(LOCATIONS_CACHE)} locations and {len(EVENTS_CACHE)} events.")
+kb_sync = KnowledgeBaseSync(GIST_RAW_BASE_URL, KNOWLEDGE_GRAPH_REPLICAS)
+
+def parse_knowledge_lines(content: str):
+    """Adds the locations and events in `content` to the caches in place."""
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith(";"):
+            continue
+
+        loc_match = re.match(r'\(location (\S+) "(.*)" ([\d\.\-]+) ([\d\.\-]+)\)', line)
+        if loc_match:
+            loc_id, name, lat, lon = loc_match.groups()
+            LOCATIONS_CACHE[loc_id] = {"name": name, "lat": float(lat), "lon": float(lon)}
+            continue
+
+        event_match = re.match(r'\(noise_event (\S+) (\S+) "([^"]+)" (\d+\.?\d*)\)', line)
+        if event_match:
+            _, loc_id, timestamp, db = event_match.groups()
+            EVENTS_CACHE.append({"loc_id": loc_id, "timestamp": timestamp, "db": float(db)})
+
+async def load_knowledge_base():
+    """Fetches what was appended since the last sync (off the event loop) and parses only that."""
+    try:
+        reset, chunks = await asyncio.to_thread(kb_sync.fetch_new)
     except Exception as e:
         print(f"ERROR: Could not load knowledge base: {e}")
+        return
+    if reset:
+        LOCATIONS_CACHE.clear()
+        EVENTS_CACHE.clear()
+    for content in chunks:
+        parse_knowledge_lines(content)
+    if reset or any(chunks):
+        print(f"Loaded {len(LOCATIONS_CACHE)} locations and {len(EVENTS_CACHE)} events.")
 
 def get_average_db(events, loc_id, night_only=False):
     vals = []
@@ -127,12 +234,13 @@ async def query_llm_with_rag(user_query: str) -> str:
 @agent.on_event("startup")
 async def startup(ctx: Context):
     ctx.logger.info(f"Fleet Manager started. Address: {agent.address}")
-    load_knowledge_base()
+    ctx.logger.info(f"Loading knowledge base from Gist: {GIST_RAW_BASE_URL}")
+    await load_knowledge_base()
 
 @agent.on_interval(period=30.0)
 async def sync_knowledge_base(ctx: Context):
     ctx.logger.info("Syncing knowledge base...")
-    load_knowledge_base()
+    await load_knowledge_base()
 
 # --- Chat Message Handling (locked protocol) ---
 @agent.on_message(model=ChatMessage, replies={ChatAcknowledgement, ChatMessage})
@@ -1,17 +1,21 @@
 # ======================================================================================
 # ECHONET - STANDALONE DEVICE NODE SCRIPT (v.FINAL)
-# This single file contains all logic for the device agent.
+# This file contains all logic for the device agent, apart from the helpers it shares
+# with the other services under fetch_services/ (the MQTT bridge and registry client).
 # HARDCODE your credentials and URLs in the configuration section below.
 # ======================================================================================
 
+import os
 import sys
 import threading
-import queue
 import paho.mqtt.client as mqtt
 import asyncio
 import hashlib
 import json
 import math
+import random
+import time
+from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
 from typing import List, Dict
 
@@ -25,6 +29,12 @@ from uagents.crypto import Identity
 from cosmpy.crypto.keypairs import PrivateKey, PublicKey
 from mnemonic import Mnemonic
 
+# Make the project root importable when this file is run as a script
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(PROJECT_ROOT)
+from fetch_services.mqtt_bridge import MqttBridge
+from fetch_services.registry_client import RegistryClient
+
 # 1. The public URL of your central Flask server (the one running api.py)
 API_BASE_URL = "https://fetch-dev.onrender.com" # e.g., "https://echonet-api.onrender.com"
 
@@ -117,18 +127,74 @@ class SmartConsensus:
 # --- Main Application Logic ---
 # ======================================================================================
 
-message_queue = queue.Queue()
+MQTT_HIGH_WATER_MARK = 256  # readings buffered before the drop policy applies
+MQTT_DROP_POLICY = "oldest"  # "oldest" or "newest" reading is dropped past the mark
+
+message_queue = MqttBridge(MQTT_HIGH_WATER_MARK, MQTT_DROP_POLICY)
 NOTARY_AGENT_ADDRESS = None
 
-def read_registry():
-    try:
-        response = requests.get(f"{API_BASE_URL}/registry", timeout=10)
-        response.raise_for_status()
-        print("✅ Successfully fetched registry from API.")
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"❌ CRITICAL: Could not fetch registry from API: {e}. Exiting.")
-        sys.exit(1)
+# ======================================================================================
+# --- Registry Client ---
+# ======================================================================================
+
+REGISTRY_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "registry_cache.json")
+REGISTRY_REFRESH_INTERVAL = 30.0
+
+registry_client = RegistryClient(API_BASE_URL, REGISTRY_CACHE_FILE)
+
+# ======================================================================================
+# --- Shared HTTP Client ---
+# ======================================================================================
+
+HTTP_MAX_CONNECTIONS = 20
+HTTP_MAX_CONNECTIONS_PER_HOST = 5
+HTTP_KEEPALIVE_TIMEOUT = 60.0
+HTTP_REQUEST_TIMEOUT = 10.0
+HTTP_CONNECT_TIMEOUT = 5.0
+HTTP_MAX_RETRIES = 3
+HTTP_RETRY_BASE_DELAY = 0.5
+
+class HttpClient:
+    """
+    One pooled aiohttp session for every outbound request the node makes, so repeated
+    posts reuse kept-alive connections instead of paying TCP/TLS setup each time.
+    Created at agent startup and closed on shutdown.
+    """
+
+    def __init__(self):
+        self.session = None
+
+    async def start(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_MAX_CONNECTIONS,
+                limit_per_host=HTTP_MAX_CONNECTIONS_PER_HOST,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300,
+            )
+            self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=HTTP_REQUEST_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT))
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    async def post_json(self, url: str, payload: dict) -> int:
+        """
+        POSTs JSON and returns the status. Only failures to open the connection are retried
+        (full-jitter backoff): after a read timeout or a 5xx the server may already have
+        stored the row, and the collectors have no way to drop a repeated POST.
+        """
+        session = await self.start()
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            try:
+                async with session.post(url, json=payload) as resp:
+                    return resp.status
+            except (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError):
+                if attempt == HTTP_MAX_RETRIES: raise
+            await asyncio.sleep(random.uniform(0, HTTP_RETRY_BASE_DELAY * 2 ** attempt))
+
+http_client = HttpClient()
 
 # --- Agent & Peer Configuration ---
 try:
@@ -146,12 +212,16 @@ except Exception as e:
         print("❌ Error: No MAC address found and none provided. Exiting.")
         sys.exit(1)
 
-ALL_CONFIGS = read_registry()
-if MAC_ADDRESS not in ALL_CONFIGS:
+# Start from the on-disk copy so a restart works even while the API is unreachable
+has_cached_registry = registry_client.load_from_disk()
+if not registry_client.fetch() and not has_cached_registry:
+    print("❌ CRITICAL: Could not fetch registry from API and no cached copy exists. Exiting.")
+    sys.exit(1)
+if MAC_ADDRESS not in registry_client:
     print(f"❌ CRITICAL: MAC Address {MAC_ADDRESS} not found in the registry. Please register it via the web UI. Exiting.")
     sys.exit(1)
 
-CONFIG = ALL_CONFIGS[MAC_ADDRESS]
+CONFIG = registry_client.get(MAC_ADDRESS)
 AGENT_NAME = CONFIG['agent_name']
 
 # --- Agent Setup ---
@@ -162,7 +232,10 @@ LOCAL_SENSOR_STATE = {}
 SENSOR_FAILURE_COUNTS = {}
 FAILURE_THRESHOLD = 5
 PENDING_LOCK = asyncio.Lock()
-pending_events = {}
+PENDING_MAX_EVENTS = 1000
+PENDING_EVENT_TIMEOUT = 15.0  # seconds to wait for peer responses
+PENDING_TIMEOUT_POLICY = "fail"  # when no peer replied by the deadline: "fail", or "accept" (like the no-peers case)
+PENDING_SWEEP_INTERVAL = 1.0
 GRID_SIZE = 0.1
 smart_consensus = SmartConsensus()
 QUORUM_RATIO = 0.45
@@ -174,6 +247,55 @@ public_key = private_key.public_key
 def get_digest(data: dict) -> bytes: return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).digest()
 def export_public_key_hex(pubkey: PublicKey) -> str: return pubkey._verifying_key.to_string().hex()
 
+class PendingEvents:
+    """
+    Events awaiting peer validation, oldest first. Every event gets a deadline and
+    the table never holds more than max_size events; the oldest are evicted first.
+    Callers mutate it under PENDING_LOCK and do their network I/O after releasing it.
+    """
+
+    def __init__(self, max_size: int, timeout: float):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.events: "OrderedDict[str, dict]" = OrderedDict()
+        self.counters = {"added": 0, "resolved": 0, "expired": 0, "evicted": 0}
+
+    def __len__(self) -> int: return len(self.events)
+    def __contains__(self, event_id: str) -> bool: return event_id in self.events
+    def get(self, event_id: str): return self.events.get(event_id)
+
+    def add(self, event_id: str, event: dict) -> list:
+        """Adds an event and returns the (event_id, event) pairs evicted to stay within max_size."""
+        event["deadline"] = time.monotonic() + self.timeout
+        self.events[event_id] = event
+        self.events.move_to_end(event_id)
+        self.counters["added"] += 1
+        evicted = []
+        while len(self.events) > self.max_size:
+            evicted.append(self.events.popitem(last=False))
+            self.counters["evicted"] += 1
+        return evicted
+
+    def pop(self, event_id: str):
+        event = self.events.pop(event_id, None)
+        if event is not None: self.counters["resolved"] += 1
+        return event
+
+    def pop_expired(self) -> list:
+        # A single timeout means insertion order is also deadline order
+        now, expired = time.monotonic(), []
+        while self.events:
+            event_id, event = next(iter(self.events.items()))
+            if event["deadline"] > now: break
+            expired.append(self.events.popitem(last=False))
+            self.counters["expired"] += 1
+        return expired
+
+    def metrics(self) -> dict:
+        return {"size": len(self.events), "max_size": self.max_size, **self.counters}
+
+pending_events = PendingEvents(PENDING_MAX_EVENTS, PENDING_EVENT_TIMEOUT)
+
 def cleanup_sensor_and_agent(mac_address: str):
     print(f"CRITICAL: Sensor with MAC {mac_address} exceeded failure threshold.")
     print(f"--> Requesting on-chain stake slash from the API server...")
@@ -185,47 +307,75 @@ def cleanup_sensor_and_agent(mac_address: str):
         )
         response.raise_for_status()
         api_ack = response.json()
-        print(f"--> API Acknowledged Slash Request: {api_ack.get('message')} (Tx: {api_ack.get('tx_hash')})")
+        print(f"--> API Acknowledged Slash Request: {api_ack.get('message')} (Job: {api_ack.get('job_id')})")
     except requests.exceptions.RequestException as e:
         print(f"--> CRITICAL: Failed to send slash request to API: {e}")
 
-def get_local_peer_group(event_location: dict) -> set:
-    local_peers = set()
-    all_configs = read_registry()
-    event_grid_id = (math.floor(event_location["latitude"] / GRID_SIZE), math.floor(event_location["longitude"] / GRID_SIZE))
-    for mac, cfg in all_configs.items():
-        if not mac.startswith('_'):
-            peer_grid_id = (math.floor(cfg["latitude"] / GRID_SIZE), math.floor(cfg["longitude"] / GRID_SIZE))
-            if peer_grid_id == event_grid_id:
-                peer_address = str(Identity.from_seed(cfg["agent_seed"], 0).address)
-                local_peers.add(peer_address)
-    return local_peers
+class PeerIndex:
+    """
+    Agent addresses bucketed by GRID_SIZE cell. A peer group is the event's cell plus
+    its neighbours, so devices either side of a cell boundary still validate each other.
+    Addresses are derived once per seed and the index is rebuilt only when the
+    registry copy changes, off the event loop by the refresh task. Entries without a
+    seed or coordinates are skipped.
+    """
+
+    def __init__(self, grid_size: float, neighbour_radius: int = 1):
+        self.grid_size = grid_size
+        self.neighbour_radius = neighbour_radius
+        self.cells: Dict[tuple, set] = {}
+        self.revision = None
+        self._address_by_seed: Dict[str, str] = {}
+        self._groups: Dict[tuple, frozenset] = {}
+
+    def cell_of(self, latitude: float, longitude: float) -> tuple:
+        return (math.floor(latitude / self.grid_size), math.floor(longitude / self.grid_size))
+
+    def rebuild(self, registry: dict, revision: int):
+        cells, addresses = {}, {}
+        for mac, cfg in registry.items():
+            if mac.startswith('_') or not isinstance(cfg, dict): continue
+            seed, latitude, longitude = cfg.get("agent_seed"), cfg.get("latitude"), cfg.get("longitude")
+            if not seed or latitude is None or longitude is None: continue
+            try:
+                cell = self.cell_of(float(latitude), float(longitude))
+            except (TypeError, ValueError):
+                continue
+            # Deriving an address is costly, so only seeds not seen before are derived
+            address = self._address_by_seed.get(seed) or str(Identity.from_seed(seed, 0).address)
+            addresses[seed] = address
+            cells.setdefault(cell, set()).add(address)
+        # Dropping the old seed map forgets deregistered devices
+        self.cells, self._address_by_seed, self._groups, self.revision = cells, addresses, {}, revision
+
+    def peers_near(self, location: dict) -> frozenset:
+        lat_cell, lon_cell = self.cell_of(location["latitude"], location["longitude"])
+        group = self._groups.get((lat_cell, lon_cell))
+        if group is None:
+            peers = set()
+            r = self.neighbour_radius
+            for d_lat in range(-r, r + 1):
+                for d_lon in range(-r, r + 1):
+                    peers |= self.cells.get((lat_cell + d_lat, lon_cell + d_lon), set())
+            group = self._groups[(lat_cell, lon_cell)] = frozenset(peers)
+        return group
+
+peer_index = PeerIndex(GRID_SIZE)
+peer_index.rebuild(registry_client.registry, registry_client.revision)
+
+def get_local_peer_group(event_location: dict) -> frozenset:
+    if peer_index.revision != registry_client.revision:
+        peer_index.rebuild(registry_client.registry, registry_client.revision)
+    return peer_index.peers_near(event_location)
 
 async def final_actions_after_consensus(ctx: Context, event_info: dict, location: dict):
     global NOTARY_AGENT_ADDRESS
     raw_data = event_info["raw_data"]
     
     transformed_data = {"deviceId": raw_data['device_id'], "timestamp": raw_data['timestamp'], "decibel": raw_data['decibel']}
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(RAW_DATA_COLLECTOR_URL, json=transformed_data, timeout=10) as resp:
-                ctx.logger.info(f"Raw data sent to collector API, status: {resp.status}")
-    except Exception as e:
-        ctx.logger.error(f"Failed to send raw data to collector API: {e}")
 
     if NOTARY_AGENT_ADDRESS is None:
-        registry = read_registry()
-        NOTARY_AGENT_ADDRESS = registry.get("_network_services", {}).get("notary_agent_address")
-    
-    if NOTARY_AGENT_ADDRESS:
-        fact = FactCandidate(validated_event=ValidatedSensorData(
-            mac_address=raw_data['device_id'],
-            timestamp=datetime.fromisoformat(raw_data['timestamp']).timestamp(),
-            sound_level_db=raw_data['decibel'],
-            location={"lat": location["latitude"], "lon": location["longitude"]}
-        ))
-        await ctx.send(NOTARY_AGENT_ADDRESS, fact)
-        ctx.logger.info("Fact candidate sent to Notary Agent.")
+        NOTARY_AGENT_ADDRESS = registry_client.notary_address
     
     payload = {
         "mac_address": raw_data['device_id'],
@@ -235,12 +385,32 @@ async def final_actions_after_consensus(ctx: Context, event_info: dict, location
         "event_type": event_info["predicted_class"],
         "metadata": {"source": "sensor_network"}
     }
+
+    # Both posts share the pooled session and run concurrently with the notary send
+    raw_result, enriched_result, _ = await asyncio.gather(
+        http_client.post_json(RAW_DATA_COLLECTOR_URL, transformed_data),
+        http_client.post_json(EXTERNAL_INGEST_API_URL, payload),
+        send_fact_to_notary(ctx, raw_data, location),
+        return_exceptions=True,
+    )
+    if isinstance(raw_result, Exception): ctx.logger.error(f"Failed to send raw data to collector API: {raw_result}")
+    else: ctx.logger.info(f"Raw data sent to collector API, status: {raw_result}")
+    if isinstance(enriched_result, Exception): ctx.logger.error(f"Failed to send enriched packet to external API: {enriched_result}")
+    else: ctx.logger.info(f"Enriched data sent to external API, status: {enriched_result}")
+
+async def send_fact_to_notary(ctx: Context, raw_data: dict, location: dict):
+    if not NOTARY_AGENT_ADDRESS: return
+    fact = FactCandidate(validated_event=ValidatedSensorData(
+        mac_address=raw_data['device_id'],
+        timestamp=datetime.fromisoformat(raw_data['timestamp']).timestamp(),
+        sound_level_db=raw_data['decibel'],
+        location={"lat": location["latitude"], "lon": location["longitude"]}
+    ))
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(EXTERNAL_INGEST_API_URL, json=payload, timeout=10) as resp:
-                ctx.logger.info(f"Enriched data sent to external API, status: {resp.status}")
+        await ctx.send(NOTARY_AGENT_ADDRESS, fact)
+        ctx.logger.info("Fact candidate sent to Notary Agent.")
     except Exception as e:
-        ctx.logger.error(f"Failed to send enriched packet to external API: {e}")
+        ctx.logger.error(f"Failed to send fact candidate to Notary Agent: {e}")
 
 validation_protocol = Protocol("WorkerAgentValidation")
 
@@ -248,10 +418,10 @@ async def handle_sensor_data(ctx: Context, sender: str, msg: SensorData):
     global LOCAL_SENSOR_STATE
     LOCAL_SENSOR_STATE = msg.dict()
     
-    all_configs = read_registry()
-    if msg.device_id not in all_configs: return
+    device_config = registry_client.get(msg.device_id)
+    if device_config is None: return
         
-    registered_location = {"latitude": all_configs[msg.device_id]["latitude"], "longitude": all_configs[msg.device_id]["longitude"]}
+    registered_location = {"latitude": device_config["latitude"], "longitude": device_config["longitude"]}
     
     predicted_class, confidence = "ambient_noise", 0.99
     # ctx.logger.info(f"Using hardcoded ML result: class='{predicted_class}', confidence={confidence}")
@@ -259,15 +429,19 @@ async def handle_sensor_data(ctx: Context, sender: str, msg: SensorData):
     event_id = hashlib.sha256(f"{msg.device_id}-{msg.timestamp}".encode()).hexdigest()
     event_local_group = get_local_peer_group(registered_location)
 
-    async with PENDING_LOCK:
-        pending_events[event_id] = {"raw_data": msg.dict(), "responses": [], "timestamp": datetime.now(timezone.utc), "predicted_class": predicted_class, "confidence": confidence}
+    event = {"raw_data": msg.dict(), "responses": [], "timestamp": datetime.now(timezone.utc), "predicted_class": predicted_class, "confidence": confidence,
+             "location": registered_location, "num_peers": len(event_local_group) - 1}
 
     if len(event_local_group) <= 1:
         ctx.logger.info(f"No peers available. Auto-accepting event {event_id}.")
-        await final_actions_after_consensus(ctx, pending_events[event_id], registered_location)
-        async with PENDING_LOCK: del pending_events[event_id]
+        await final_actions_after_consensus(ctx, event, registered_location)
         return
 
+    async with PENDING_LOCK:
+        evicted = pending_events.add(event_id, event)
+    for evicted_id, _ in evicted:
+        ctx.logger.warning(f"Pending table full ({pending_events.max_size}). Evicted oldest event {evicted_id}.")
+
     request_data = {"event_id": event_id, "location": registered_location, "sound_class": predicted_class, "decibel": msg.decibel}
     validation_request = ValidationRequest(**request_data, public_key=export_public_key_hex(public_key), signature=private_key.sign(get_digest(request_data)).hex())
 
@@ -281,37 +455,75 @@ async def handle_validation_request(ctx: Context, sender: str, msg: ValidationRe
     response_data = {"event_id": msg.event_id, "validated": is_plausible}
     await ctx.send(sender, ValidationResponse(**response_data, public_key=export_public_key_hex(public_key), signature=private_key.sign(get_digest(response_data)).hex()))
 
+async def record_consensus_failure(mac_address: str):
+    SENSOR_FAILURE_COUNTS[mac_address] = SENSOR_FAILURE_COUNTS.get(mac_address, 0) + 1
+    if SENSOR_FAILURE_COUNTS[mac_address] >= FAILURE_THRESHOLD:
+        SENSOR_FAILURE_COUNTS[mac_address] = 0
+        await asyncio.to_thread(cleanup_sensor_and_agent, mac_address)
+
 @validation_protocol.on_message(model=ValidationResponse, replies=set())
 async def handle_validation_response(ctx: Context, sender: str, msg: ValidationResponse):
+    if msg.event_id not in pending_events: return
+    try:
+        if not PublicKey(bytes.fromhex(msg.public_key)).verify(get_digest({"event_id": msg.event_id, "validated": msg.validated}), bytes.fromhex(msg.signature)):
+            ctx.logger.warning(f"INVALID SIGNATURE from {sender}. Discarding."); return
+    except Exception as e:
+        ctx.logger.error(f"Signature verification failed for {sender}: {e}"); return
+
+    # Decide under the lock, act after releasing it
+    outcome = None
     async with PENDING_LOCK:
-        if msg.event_id not in pending_events: return
-        event = pending_events[msg.event_id]
-        
-        try:
-            if not PublicKey(bytes.fromhex(msg.public_key)).verify(get_digest({"event_id": msg.event_id, "validated": msg.validated}), bytes.fromhex(msg.signature)):
-                ctx.logger.warning(f"INVALID SIGNATURE from {sender}. Discarding."); return
-        except Exception as e:
-            ctx.logger.error(f"Signature verification failed for {sender}: {e}"); return
-        
+        event = pending_events.get(msg.event_id)
+        if event is None: return
         event["responses"].append(msg)
-        
-        registered_location = read_registry()[event["raw_data"]['device_id']]
-        num_peers_in_group = len(get_local_peer_group(registered_location)) - 1
+        num_peers_in_group = event["num_peers"]
         
         positive_responses = sum(1 for res in event["responses"] if res.validated)
         
         if positive_responses >= math.ceil(num_peers_in_group * QUORUM_RATIO):
-            ctx.logger.info(f"CONSENSUS REACHED for event {msg.event_id}.")
-            await final_actions_after_consensus(ctx, event, registered_location)
-            del pending_events[msg.event_id]
+            outcome = "accepted"
+            pending_events.pop(msg.event_id)
         elif len(event["responses"]) >= num_peers_in_group:
-            ctx.logger.warning(f"CONSENSUS FAILED for event {msg.event_id}.")
-            mac_address = event["raw_data"]["device_id"]
-            SENSOR_FAILURE_COUNTS[mac_address] = SENSOR_FAILURE_COUNTS.get(mac_address, 0) + 1
-            if SENSOR_FAILURE_COUNTS[mac_address] >= FAILURE_THRESHOLD:
-                cleanup_sensor_and_agent(mac_address)
-                SENSOR_FAILURE_COUNTS[mac_address] = 0
-            del pending_events[msg.event_id]
+            outcome = "failed"
+            pending_events.pop(msg.event_id)
+
+    if outcome == "accepted":
+        ctx.logger.info(f"CONSENSUS REACHED for event {msg.event_id}.")
+        await final_actions_after_consensus(ctx, event, event["location"])
+    elif outcome == "failed":
+        ctx.logger.warning(f"CONSENSUS FAILED for event {msg.event_id}.")
+        await record_consensus_failure(event["raw_data"]["device_id"])
+
+@agent.on_interval(period=PENDING_SWEEP_INTERVAL)
+async def expire_pending_events(ctx: Context):
+    async with PENDING_LOCK:
+        expired = pending_events.pop_expired()
+    if not expired: return
+    for event_id, event in expired:
+        responses = event["responses"]
+        if responses:
+            # Same quorum as on arrival, over the whole group: a silent peer never counts as a yes
+            positive_responses = sum(1 for res in responses if res.validated)
+            accepted = positive_responses >= math.ceil(event["num_peers"] * QUORUM_RATIO)
+        else:
+            accepted = PENDING_TIMEOUT_POLICY == "accept"
+        summary = f"Event {event_id} timed out with {len(responses)}/{event['num_peers']} responses"
+        if accepted:
+            ctx.logger.info(f"{summary}. Accepting.")
+            await final_actions_after_consensus(ctx, event, event["location"])
+        else:
+            ctx.logger.warning(f"{summary}. Treating as failed.")
+            await record_consensus_failure(event["raw_data"]["device_id"])
+    ctx.logger.info(f"Pending events: {pending_events.metrics()}")
+
+@agent.on_interval(period=REGISTRY_REFRESH_INTERVAL)
+async def refresh_registry(ctx: Context):
+    try:
+        if await registry_client.refresh(await http_client.start()):
+            ctx.logger.info(f"Registry updated ({len(registry_client.registry)} entries).")
+            await asyncio.to_thread(peer_index.rebuild, registry_client.registry, registry_client.revision)
+    except Exception as e:
+        ctx.logger.warning(f"Registry refresh failed, keeping local copy: {e}")
 
 # --- MQTT Client Logic ---
 def on_connect(client, userdata, flags, rc, properties):
@@ -328,15 +540,17 @@ def start_mqtt_client():
     client.connect(MQTT_BROKER, MQTT_PORT, 60)
     client.loop_forever()
 
-@agent.on_interval(period=0.5)
-async def process_mqtt_queue(ctx: Context):
-    if not message_queue.empty():
-        try:
-            sensor_data = message_queue.get_nowait()
-            ctx.logger.info(f"Pulled sensor data from MQTT queue for device: {sensor_data.device_id}")
-            await handle_sensor_data(ctx, agent.address, sensor_data)
-        except queue.Empty: pass
-        except Exception as e: ctx.logger.error(f"Error processing item from queue: {e}")
+@agent.on_event("startup")
+async def start_http_client(ctx: Context):
+    await http_client.start()
+
+@agent.on_event("shutdown")
+async def close_http_client(ctx: Context):
+    await http_client.close()
+
+@agent.on_event("startup")
+async def start_mqtt_bridge(ctx: Context):
+    message_queue.start(lambda sensor_data: handle_sensor_data(ctx, agent.address, sensor_data), ctx.logger)
 
 # --- Main Execution ---
 if __name__ == "__main__":
@@ -1,6 +1,10 @@
 import sys
 import os
 import json
+import asyncio
+import re
+import time
+import aiohttp
 import requests
 from uagents import Agent, Context
 from datetime import datetime, timezone
@@ -17,6 +21,8 @@ from config.settings import AGENTVERSE_API_KEY, GITHUB_PAT, KNOWLEDGE_GRAPH_GIST
 
 # Import the schema for the incoming message
 from fetch_services.agents.schemas import FactCandidate
+from fetch_services.knowledge_graph.kg_store import SegmentStore, GistPublisher
+from fetch_services.registry_client import RegistryClient
 
 # --- Agent Definition ---
 NOTARY_SEED = "notary_agent_super_secret_seed_phrase_for_echonet"
@@ -29,91 +35,256 @@ agent = Agent(
 )
 
 # --- State and Gist Helpers ---
-SENSOR_REGISTRY = {}
 WRITTEN_LOCATIONS = set()
+WRITING_LOCATIONS = set()  # location atoms being appended right now, not yet on disk
 EVENT_COUNTER = 0
-GIST_API_URL = f"https://api.github.com/gists/{KNOWLEDGE_GRAPH_GIST_ID}"
+# The graph is kept locally as append-only segments and only new segments are shipped to the Gist.
+# KNOWLEDGE_GRAPH_API_URL can point at a local stand-in for the Gist API.
+GIST_API_URL = os.getenv("KNOWLEDGE_GRAPH_API_URL", f"https://api.github.com/gists/{KNOWLEDGE_GRAPH_GIST_ID}")
 GIST_HEADERS = {"Authorization": f"token {GITHUB_PAT}", "Accept": "application/vnd.github.v3+json"}
+KNOWLEDGE_GRAPH_DIR = os.getenv("KNOWLEDGE_GRAPH_DIR", os.path.join(PROJECT_ROOT, "kg_segments"))
+KG_SEGMENT_MAX_BYTES = int(os.getenv("KG_SEGMENT_MAX_BYTES", str(256 * 1024)))
+# Facts are committed to the Gist in batches: once this many are waiting, or every interval
+KG_FLUSH_MAX_FACTS = int(os.getenv("KG_FLUSH_MAX_FACTS", "500"))
+KG_FLUSH_INTERVAL = float(os.getenv("KG_FLUSH_INTERVAL", "2"))
+UNPUBLISHED_FACTS = 0
+PUBLISH_TASK = None
+# Event ids are "N<sequence>-<replica>". The sequence is the larger of the last one used + 1 and
+# the current time in ms, so ids keep increasing across restarts and roughly order across replicas;
+# the replica suffix keeps them unique when several notaries run at once. List every replica id in
+# the Decibal agent's KNOWLEDGE_GRAPH_REPLICAS so it merges all of them.
+NOTARY_REPLICA_ID = os.getenv("NOTARY_REPLICA_ID", "0")
+CHECKPOINT_FILE = os.path.join(KNOWLEDGE_GRAPH_DIR, "checkpoint.json")
+CHECKPOINT_POSITION = None
 
-def update_knowledge_graph_gist(new_content: str, ctx: Context):
+# Segments and manifest carry the replica id, e.g. knowledge_graph.0.000000.metta and knowledge_graph.0.index.json
+kg_store = SegmentStore(KNOWLEDGE_GRAPH_DIR, segment_max_bytes=KG_SEGMENT_MAX_BYTES, prefix=f"knowledge_graph.{NOTARY_REPLICA_ID}")
+kg_publisher = GistPublisher(GIST_API_URL, GIST_HEADERS) if KNOWLEDGE_GRAPH_GIST_ID else None
+
+def next_event_sequence() -> int:
+    global EVENT_COUNTER
+    EVENT_COUNTER = max(EVENT_COUNTER + 1, int(time.time() * 1000))
+    return EVENT_COUNTER
+
+def load_checkpoint():
     """
-    Atomically updates the public knowledge graph Gist by fetching its
-    current content, appending the new atoms, and patching it.
+    Restores the event counter and written locations from the checkpoint, then replays only
+    the atoms appended after the checkpointed position, so restart cost does not grow with
+    the graph. Without a checkpoint the whole local graph is scanned once.
     """
+    global WRITTEN_LOCATIONS, EVENT_COUNTER, CHECKPOINT_POSITION
     try:
-        # Step 1: Get the current content of the Gist file.
-        response = requests.get(GIST_API_URL, headers=GIST_HEADERS, timeout=10)
-        response.raise_for_status()
-        # We assume the Gist has a file named 'knowledge_graph.metta'
-        current_content = response.json()['files']['knowledge_graph.metta']['content']
-        
-        # Step 2: Append the new atoms to the current content.
-        updated_content = current_content + new_content
-        
-        # Step 3: Send a PATCH request to update the Gist.
-        payload = {"files": {"knowledge_graph.metta": {"content": updated_content}}}
-        patch_response = requests.patch(GIST_API_URL, headers=GIST_HEADERS, json=payload, timeout=10)
-        patch_response.raise_for_status()
-        
-        ctx.logger.info("Successfully updated public knowledge graph Gist.")
-    except requests.exceptions.RequestException as e:
-        ctx.logger.error(f"Failed to update knowledge graph Gist: {e}")
-    except KeyError:
-        ctx.logger.error("Gist does not contain a 'knowledge_graph.metta' file. Please check your Gist setup.")
+        with open(CHECKPOINT_FILE, "r") as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        checkpoint = {}
+    WRITTEN_LOCATIONS = set(checkpoint.get("written_locations", []))
+    EVENT_COUNTER = checkpoint.get("event_counter", 0)
+    CHECKPOINT_POSITION = checkpoint.get("position")
+    tail = kg_store.read_from(CHECKPOINT_POSITION)
+    for line in tail.splitlines():
+        location = re.match(r'\(location (\S+) ', line)
+        if location:
+            WRITTEN_LOCATIONS.add(location.group(1))
+        event = re.match(r'\(noise_event N(\d+)', line)
+        if event:
+            EVENT_COUNTER = max(EVENT_COUNTER, int(event.group(1)))
+    return len(tail)
 
-
-def load_sensor_registry():
+def snapshot_checkpoint():
     """
-    Fetches the sensor registry from the Flask API.
+    The notary state together with the graph position it covers, or None if the graph has
+    not moved since the last save. Called on the event loop, which is the only writer of
+    the state, so it is never read mid-update.
     """
+    # State is read before the position: an atom landing in between is at worst re-emitted, never lost
+    checkpoint = {"event_counter": EVENT_COUNTER, "written_locations": sorted(WRITTEN_LOCATIONS)}
+    checkpoint["position"] = kg_store.position()
+    if checkpoint["position"] == CHECKPOINT_POSITION:
+        return None
+    return checkpoint
+
+def write_checkpoint(checkpoint: dict):
+    """Atomically writes a checkpoint taken by snapshot_checkpoint(); safe to run in a thread."""
+    global CHECKPOINT_POSITION
+    tmp_path = CHECKPOINT_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, CHECKPOINT_FILE)
+    CHECKPOINT_POSITION = checkpoint["position"]
+
+async def publish_knowledge_graph(ctx: Context):
+    """Ships segments with unpublished atoms as one commit; whatever fails stays pending for the next flush."""
+    global UNPUBLISHED_FACTS
+    if kg_publisher is None:
+        return
+    batch, UNPUBLISHED_FACTS = UNPUBLISHED_FACTS, 0
     try:
-        response = requests.get(f"{API_BASE_URL}/registry", timeout=10)
-        response.raise_for_status()
-        return response.json()
+        shipped = await asyncio.to_thread(kg_publisher.publish, kg_store)
+        if shipped:
+            ctx.logger.info(f"Committed {batch} fact(s) in {shipped} knowledge graph segment(s) to the Gist.")
     except requests.exceptions.RequestException as e:
-        print(f"Failed to load sensor registry from API: {e}")
-        return {}
+        UNPUBLISHED_FACTS += batch
+        ctx.logger.error(f"Failed to publish knowledge graph segments: {e}")
+
+def schedule_publish(ctx: Context):
+    """Starts a flush unless one is already running."""
+    global PUBLISH_TASK
+    if PUBLISH_TASK is None or PUBLISH_TASK.done():
+        PUBLISH_TASK = asyncio.create_task(publish_knowledge_graph(ctx))
+
+async def append_to_knowledge_graph(new_content: str, ctx: Context):
+    """
+    Appends atoms to the local segment store and fsyncs them before returning, so the
+    store doubles as the write-ahead buffer: an accepted fact survives a crash and is
+    published by the next flush. Publishing happens in batches, not per fact.
+    """
+    global UNPUBLISHED_FACTS
+    await asyncio.to_thread(kg_store.append, new_content, True)
+    UNPUBLISHED_FACTS += 1
+    if UNPUBLISHED_FACTS >= KG_FLUSH_MAX_FACTS:
+        schedule_publish(ctx)
+
+
+# --- Sensor Registry ---
+REGISTRY_REFRESH_INTERVAL = 30.0
+REGISTRY_MISS_TTL = 30.0  # how long an unknown MAC is remembered before asking the API again
+
+class SensorRegistryView(RegistryClient):
+    """
+    In-memory copy of the sensor registry used to resolve incoming facts, kept fresh by
+    the shared RegistryClient. A fact for a MAC the copy does not know triggers a
+    single-device fetch, and MACs the API does not know either are remembered for
+    `miss_ttl` seconds. All HTTP is async.
+    """
+
+    def __init__(self, base_url: str, miss_ttl: float = REGISTRY_MISS_TTL):
+        super().__init__(base_url)
+        self.miss_ttl = miss_ttl
+        self.session = None
+        self._misses = {}    # mac -> monotonic time of the last "not registered" answer
+        self._fetching = {}  # mac -> in-flight single-device fetch, shared by concurrent facts
+
+    async def start(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    @property
+    def device_count(self) -> int:
+        return len([k for k in self.registry if not k.startswith('_')])
+
+    def _replace(self, registry: dict, etag) -> bool:
+        changed = super()._replace(registry, etag)
+        if changed:
+            self._misses.clear()
+        return changed
+
+    async def lookup(self, mac_address: str):
+        """Registry entry for `mac_address`, or None if it is not registered."""
+        entry = self.registry.get(mac_address)
+        if entry is not None:
+            return entry
+        missed_at = self._misses.get(mac_address)
+        if missed_at is not None and time.monotonic() - missed_at < self.miss_ttl:
+            return None
+        fetch = self._fetching.get(mac_address)
+        if fetch is None:
+            fetch = self._fetching[mac_address] = asyncio.ensure_future(self._fetch_one(mac_address))
+            fetch.add_done_callback(lambda _: self._fetching.pop(mac_address, None))
+        return await asyncio.shield(fetch)
+
+    async def _fetch_one(self, mac_address: str):
+        session = await self.start()
+        try:
+            async with session.get(f"{self.base_url}/registry/{mac_address}") as resp:
+                if resp.status == 404:
+                    self._misses[mac_address] = time.monotonic()
+                    return None
+                resp.raise_for_status()
+                entry = await resp.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Failed to fetch registry entry for {mac_address}: {e}")
+            return None
+        # Copy-on-write, like a refresh, so readers never see a half-updated dict
+        self.registry = {**self.registry, mac_address: entry}
+        self.revision += 1
+        return entry
+
+sensor_registry = SensorRegistryView(API_BASE_URL)
+
 
 @agent.on_event("startup")
 async def startup(ctx: Context):
     """
-    On startup, the Notary loads the sensor registry from Flask API and initializes the
-    public knowledge base Gist, ensuring it starts from a clean slate.
+    On startup, the Notary loads the sensor registry from Flask API, resumes its state from
+    the checkpoint and makes sure the knowledge graph has its header, then publishes
+    anything left unpublished.
     """
-    global SENSOR_REGISTRY, WRITTEN_LOCATIONS, EVENT_COUNTER
     ctx.logger.info(f"Notary Agent starting up. Address: {agent.address}")
     
     # Load registry from Flask API instead of local file
-    SENSOR_REGISTRY = load_sensor_registry()
-    if SENSOR_REGISTRY:
+    try:
+        await sensor_registry.refresh(await sensor_registry.start())
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        ctx.logger.warning(f"Could not load sensor registry from API: {e}")
+    if sensor_registry.device_count:
         # Count only actual devices (exclude _network_services)
-        device_count = len([k for k in SENSOR_REGISTRY.keys() if not k.startswith('_')])
-        ctx.logger.info(f"Successfully loaded sensor registry with {device_count} devices from API.")
+        ctx.logger.info(f"Successfully loaded sensor registry with {sensor_registry.device_count} devices from API.")
     else:
-        ctx.logger.warning("Could not load sensor registry from API or registry is empty.")
+        ctx.logger.warning("Sensor registry is empty; devices will be fetched as their facts arrive.")
 
-    # Initialize the public Gist with a header
-    initial_content = "; EchoNet Shared Knowledge Graph\n; Managed by the Notary Agent.\n"
-    update_knowledge_graph_gist(initial_content, ctx)
-    
-    WRITTEN_LOCATIONS = set()
-    EVENT_COUNTER = 0
-    ctx.logger.info("Public knowledge base Gist initialized.")
+    # A new graph starts with a header; an existing one is appended to, never rewritten
+    if kg_store.is_empty():
+        kg_store.append("; EchoNet Shared Knowledge Graph\n; Managed by the Notary Agent.\n")
+    replayed = await asyncio.to_thread(load_checkpoint)
+    await publish_knowledge_graph(ctx)
+    ctx.logger.info(f"Knowledge graph ready with {len(kg_store.segments)} segment(s); "
+                    f"resumed {len(WRITTEN_LOCATIONS)} locations, replayed {replayed} bytes past the checkpoint.")
+
+@agent.on_event("shutdown")
+async def shutdown(ctx: Context):
+    await sensor_registry.close()
+    checkpoint = snapshot_checkpoint()
+    if checkpoint is not None:
+        write_checkpoint(checkpoint)
+
+@agent.on_interval(period=REGISTRY_REFRESH_INTERVAL)
+async def refresh_registry(ctx: Context):
+    try:
+        if await sensor_registry.refresh(await sensor_registry.start()):
+            ctx.logger.info(f"Registry updated ({sensor_registry.device_count} devices).")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        ctx.logger.warning(f"Registry refresh failed, keeping local copy: {e}")
+
+@agent.on_interval(period=KG_FLUSH_INTERVAL)
+async def flush_knowledge_graph(ctx: Context):
+    """Time-based flush: commits whatever facts (or failed earlier commits) are still pending."""
+    schedule_publish(ctx)
+    checkpoint = snapshot_checkpoint()
+    if checkpoint is None:
+        return
+    try:
+        await asyncio.to_thread(write_checkpoint, checkpoint)
+    except OSError as e:
+        ctx.logger.error(f"Failed to save notary checkpoint: {e}")
 
 @agent.on_message(model=FactCandidate, replies=set())
 async def add_fact_to_kb(ctx: Context, sender: str, msg: FactCandidate):
     """
     Receives a validated fact and writes it to the PUBLIC knowledge graph Gist.
     """
-    global SENSOR_REGISTRY, WRITTEN_LOCATIONS, EVENT_COUNTER
-    
     data = msg.validated_event
     ctx.logger.info(f"Received fact candidate from worker for device {data.mac_address}")
     
-    # Refresh sensor registry from API to get latest data
-    SENSOR_REGISTRY = load_sensor_registry()
-    
-    sensor_info = SENSOR_REGISTRY.get(data.mac_address)
+    # Resolved from the cached registry; only unknown MACs reach the API
+    sensor_info = await sensor_registry.lookup(data.mac_address)
     if not sensor_info:
         ctx.logger.warning(f"Received fact for unregistered MAC address {data.mac_address}. Discarding.")
         return
@@ -122,21 +293,28 @@ async def add_fact_to_kb(ctx: Context, sender: str, msg: FactCandidate):
     new_atoms_to_write = ""
     
     # Location Atom Logic: Add the location atom only if it's new.
-    # To be robust, we need to check the Gist content itself. For this prototype,
-    # the in-memory WRITTEN_LOCATIONS is a good-enough approximation.
-    if loc_id not in WRITTEN_LOCATIONS:
+    # WRITTEN_LOCATIONS survives restarts through the checkpoint; the id is reserved in
+    # WRITING_LOCATIONS before the append is awaited, so concurrent facts write it only once.
+    new_location = loc_id not in WRITTEN_LOCATIONS and loc_id not in WRITING_LOCATIONS
+    if new_location:
+        WRITING_LOCATIONS.add(loc_id)
         new_atoms_to_write += f"\n; --- Location Definition: {sensor_info['name']} ---\n"
         new_atoms_to_write += f"(location {loc_id} \"{sensor_info['name']}\" {sensor_info['latitude']} {sensor_info['longitude']})\n"
-        WRITTEN_LOCATIONS.add(loc_id)
 
     # Noise Event Atom Logic: Always add a new event.
-    EVENT_COUNTER += 1
-    event_id = f"N{str(EVENT_COUNTER).zfill(3)}"
+    event_id = f"N{next_event_sequence()}-{NOTARY_REPLICA_ID}"
     iso_timestamp = datetime.fromtimestamp(data.timestamp, tz=timezone.utc).isoformat()
     new_atoms_to_write += f"(noise_event {event_id} {loc_id} \"{iso_timestamp}\" {data.sound_level_db})\n"
     
-    # Update the public Gist with the new atoms
-    update_knowledge_graph_gist(new_atoms_to_write, ctx)
+    # Durably append the new atoms; they reach the public Gist with the next batch
+    try:
+        await append_to_knowledge_graph(new_atoms_to_write, ctx)
+        if new_location:
+            # Only once the atom is on disk, so a checkpoint never claims a location that was not written
+            WRITTEN_LOCATIONS.add(loc_id)
+    finally:
+        if new_location:
+            WRITING_LOCATIONS.discard(loc_id)
 
 if __name__ == "__main__":
     print(f"Starting Notary Agent...")
@@ -0,0 +1,67 @@
+"""
+Benchmark: per-peer consensus_validation vs. the vectorized batch path.
+
+Run from Protocol/Fetch.Ai:
+    python -m fetch_services.consensus.bench_consensus
+"""
+import contextlib
+import os
+import random
+import timeit
+
+import numpy as np
+
+from fetch_services.consensus.consensus_logic import (
+    SmartConsensus,
+    haversine_distance,
+    expected_decibel_at_distance,
+)
+
+PEER_COUNTS = (10, 100, 1000)
+REPEATS = 5
+
+
+def make_reports(num_peers: int, seed: int = 42):
+    rng = random.Random(seed)
+    request_data = {"location": {"latitude": 28.5, "longitude": 77.0}, "decibel": 85.0}
+    peer_reports = []
+    for _ in range(num_peers):
+        cfg = {"latitude": 28.5 + rng.uniform(-0.05, 0.05), "longitude": 77.0 + rng.uniform(-0.05, 0.05)}
+        peer_reports.append(({"decibel": rng.uniform(10.0, 90.0)}, cfg))
+    return request_data, peer_reports
+
+
+def check_identical(consensus: SmartConsensus, request_data: dict, peer_reports: list):
+    loc = request_data["location"]
+    result = consensus.batch_validate(
+        [[loc["latitude"], loc["longitude"]]], [request_data["decibel"]],
+        [[cfg["latitude"], cfg["longitude"]] for _, cfg in peer_reports],
+        [data["decibel"] for data, _ in peer_reports],
+    )
+    for i, (data, cfg) in enumerate(peer_reports):
+        distance = haversine_distance(loc["latitude"], loc["longitude"], cfg["latitude"], cfg["longitude"])
+        assert np.isclose(result.distances[0, i], distance)
+        assert np.isclose(result.expected_db[0, i], expected_decibel_at_distance(request_data["decibel"], distance))
+        assert bool(result.accepted[0, i]) == consensus.validate_event(request_data, data, cfg)
+    for threshold in (0.3, 0.6, 0.9):
+        assert consensus.consensus_validation(request_data, peer_reports, threshold) == \
+            consensus.consensus_validation_batch(request_data, peer_reports, threshold)
+
+
+def main():
+    consensus = SmartConsensus()
+    print(f"{'peers':>6} {'per-peer (ms)':>14} {'batch (ms)':>11} {'speedup':>8}")
+    with open(os.devnull, "w") as devnull:
+        for num_peers in PEER_COUNTS:
+            request_data, peer_reports = make_reports(num_peers)
+            with contextlib.redirect_stdout(devnull):
+                check_identical(consensus, request_data, peer_reports)
+                scalar = min(timeit.repeat(
+                    lambda: consensus.consensus_validation(request_data, peer_reports), number=10, repeat=REPEATS)) / 10
+                batch = min(timeit.repeat(
+                    lambda: consensus.consensus_validation_batch(request_data, peer_reports), number=10, repeat=REPEATS)) / 10
+            print(f"{num_peers:>6} {scalar * 1e3:>14.3f} {batch * 1e3:>11.3f} {scalar / batch:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,7 @@
 import math
+from typing import NamedTuple
+
+import numpy as np
 
 # --- Tunable Parameters ---
 REFERENCE_DISTANCE = 1.0  # Reference point for inverse-square law
@@ -36,6 +39,41 @@ def expected_decibel_at_distance(source_db, distance):
     return source_db - spreading_loss - absorption_loss
 
 
+def haversine_distance_matrix(lat1, lon1, lat2, lon2):
+    """
+    Vectorized haversine. Inputs broadcast like NumPy arrays, so (E, 1) event
+    coordinates against (P,) peer coordinates give an (E, P) distance matrix.
+    """
+    R = 6371e3
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    delta_phi = np.radians(np.subtract(lat2, lat1))
+    delta_lambda = np.radians(np.subtract(lon2, lon1))
+
+    a = np.sin(delta_phi / 2) ** 2 + \
+        np.cos(phi1) * np.cos(phi2) * \
+        np.sin(delta_lambda / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return R * c
+
+
+def expected_decibel_at_distance_array(source_db, distance):
+    """Vectorized expected_decibel_at_distance; source_db broadcasts against distance."""
+    distance = np.maximum(distance, REFERENCE_DISTANCE)  # avoid log(0)
+    spreading_loss = 20 * np.log10(distance / REFERENCE_DISTANCE)
+    absorption_loss = ATTENUATION_COEFFICIENT * (distance - REFERENCE_DISTANCE)
+    return source_db - spreading_loss - absorption_loss
+
+
+class BatchConsensusResult(NamedTuple):
+    """Per-(event, peer) arrays of shape (E, P) plus per-event scores of shape (E,)."""
+    distances: np.ndarray
+    expected_db: np.ndarray
+    louder_than_expected: np.ndarray
+    accepted: np.ndarray
+    scores: np.ndarray
+
+
 class SmartConsensus:
     """
     Smart, cross-sensor validation with temporal, physics, and consensus checks.
@@ -119,3 +157,77 @@ class SmartConsensus:
         else:
             print("❌ CONSENSUS: Event REJECTED 0.\n")
             return False
+
+    def batch_validate(
+        self,
+        event_locations,   # (E, 2) latitude/longitude of each orchestrator
+        event_decibels,    # (E,) decibel reported for each event
+        peer_locations,    # (P, 2) latitude/longitude of each peer
+        peer_decibels,     # (E, P) or (P,) each peer's own reading
+        peer_weights=None  # (P,) vote weights, defaults to 1 per peer
+    ) -> BatchConsensusResult:
+        """
+        Evaluate many events against many peers in one NumPy pass.
+
+        Acceptance follows validate_event exactly: a peer rejects only when its own
+        reading is below the noise floor. The physics check is still computed and
+        returned as louder_than_expected. Peers with NaN coordinates carry no weight,
+        matching consensus_validation skipping peers without a location.
+        """
+        event_locations = np.asarray(event_locations, dtype=float).reshape(-1, 2)
+        peer_locations = np.asarray(peer_locations, dtype=float).reshape(-1, 2)
+        event_decibels = np.asarray(event_decibels, dtype=float).reshape(-1)
+        peer_decibels = np.broadcast_to(
+            np.asarray(peer_decibels, dtype=float), (len(event_locations), len(peer_locations))
+        )
+
+        distances = haversine_distance_matrix(
+            event_locations[:, 0:1], event_locations[:, 1:2],
+            peer_locations[:, 0], peer_locations[:, 1]
+        )
+        expected_db = expected_decibel_at_distance_array(event_decibels[:, None], distances)
+        louder_than_expected = peer_decibels > expected_db + CALIBRATION_MARGIN
+        accepted = peer_decibels >= NOISE_FLOOR_THRESHOLD
+
+        weights = np.ones(len(peer_locations)) if peer_weights is None else np.asarray(peer_weights, dtype=float)
+        weights = np.where(np.isnan(peer_locations).any(axis=1), 0.0, weights)
+        total_weight = weights.sum()
+        accept_weight = (accepted * weights).sum(axis=1)
+        scores = accept_weight / total_weight if total_weight > 0 else np.zeros(len(event_locations))
+
+        return BatchConsensusResult(distances, expected_db, louder_than_expected, accepted, scores)
+
+    def consensus_validation_batch(
+        self,
+        request_data: dict,
+        peer_reports: list,   # list of (peer_sensor_data, peer_agent_config)
+        threshold: float = 0.6
+    ) -> bool:
+        """
+        Drop-in replacement for consensus_validation that evaluates all peers at once.
+
+        Returns:
+            bool: True if consensus validates the event, False otherwise.
+        """
+        located = [
+            (data, cfg) for data, cfg in peer_reports
+            if "latitude" in cfg and "longitude" in cfg
+        ]
+        if located:
+            result = self.batch_validate(
+                [[request_data['location']['latitude'], request_data['location']['longitude']]],
+                [request_data['decibel']],
+                [[cfg["latitude"], cfg["longitude"]] for _, cfg in located],
+                [data['decibel'] for data, _ in located],
+            )
+            consensus_score = float(result.scores[0])
+        else:
+            consensus_score = 0
+        print(f"\nConsensus Score: {consensus_score:.2f} (threshold={threshold})")
+
+        if consensus_score >= threshold:
+            print("✅ CONSENSUS: Event validated by network.\n")
+            return True
+        else:
+            print("❌ CONSENSUS: Event REJECTED 0.\n")
+            return False
@@ -0,0 +1,176 @@
+import json
+import os
+import threading
+
+import requests
+
+INDEX_FILE = "index.json"
+
+
+class SegmentStore:
+    """
+    Local append-only knowledge graph, split into rotating .metta segment files named
+    "<prefix>.NNNNNN.metta". Each notary replica uses its own prefix, so replicas sharing
+    one Gist never overwrite each other's segments.
+
+    Atoms are appended to the active segment; once it reaches `segment_max_bytes` it is
+    sealed and a new one is started, so no single file grows with the full history.
+    index.json records each segment's name, size, sealed flag and how many of its bytes
+    the remote already has. Sizes are re-read from disk on load, so an append that made
+    it to disk before a crash is never lost, and a torn final line is trimmed.
+    """
+
+    def __init__(self, directory: str, segment_max_bytes: int = 256 * 1024, prefix: str = "knowledge_graph"):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.segments = self._load_index()
+        if not self.segments:
+            self.segments = [self._new_segment(0)]
+            self._save_index()
+
+    # --- Index ---
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _new_segment(self, number: int) -> dict:
+        name = f"{self.prefix}.{number:06d}.metta"
+        open(self._path(name), "ab").close()
+        return {"name": name, "bytes": 0, "published_bytes": 0, "sealed": False}
+
+    def _load_index(self) -> list:
+        try:
+            with open(self._path(INDEX_FILE), "r") as f:
+                segments = json.load(f)["segments"]
+        except FileNotFoundError:
+            return []
+        for segment in segments:
+            size = os.path.getsize(self._path(segment["name"]))
+            if not segment["sealed"] and size:
+                size = self._trim_torn_tail(segment["name"], size)
+            segment["bytes"] = size
+            segment["published_bytes"] = min(segment["published_bytes"], size)
+        return segments
+
+    def _trim_torn_tail(self, name: str, size: int) -> int:
+        with open(self._path(name), "rb+") as f:
+            f.seek(max(0, size - 4096))
+            tail = f.read()
+            if tail.endswith(b"\n"):
+                return size
+            cut = tail.rfind(b"\n")
+            size = size - len(tail) + cut + 1 if cut >= 0 else max(0, size - len(tail))
+            f.truncate(size)
+        return size
+
+    def _save_index(self):
+        # Caller holds _lock (or is the constructor)
+        tmp_path = self._path(INDEX_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"segments": self.segments}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path(INDEX_FILE))
+
+    # --- Writes ---
+
+    def is_empty(self) -> bool:
+        return all(segment["bytes"] == 0 for segment in self.segments)
+
+    def append(self, text: str, fsync: bool = False):
+        data = text.encode("utf-8")
+        with self._lock:
+            active = self.segments[-1]
+            if active["bytes"] and active["bytes"] + len(data) > self.segment_max_bytes:
+                active["sealed"] = True
+                active = self._new_segment(len(self.segments))
+                self.segments.append(active)
+                self._save_index()
+            with open(self._path(active["name"]), "ab") as f:
+                f.write(data)
+                f.flush()
+                if fsync:
+                    os.fsync(f.fileno())
+            active["bytes"] += len(data)
+
+    # --- Positions ---
+
+    def position(self) -> list:
+        """[segment number, byte offset] of the end of the graph; stable across restarts."""
+        with self._lock:
+            return [len(self.segments) - 1, self.segments[-1]["bytes"]]
+
+    def read_from(self, position) -> str:
+        """Everything appended after `position` (from position()); the whole graph if it is unknown."""
+        number, offset = position if position else (0, 0)
+        with self._lock:
+            if number >= len(self.segments) or offset > self.segments[number]["bytes"]:
+                number, offset = 0, 0
+            sizes = [(s["name"], s["bytes"]) for s in self.segments[number:]]
+        chunks = []
+        for name, size in sizes:
+            with open(self._path(name), "rb") as f:
+                f.seek(offset)
+                chunks.append(f.read(size - offset))
+            offset = 0
+        return b"".join(chunks).decode("utf-8")
+
+    # --- Publishing ---
+
+    @property
+    def manifest_name(self) -> str:
+        """Name of the segment manifest published next to the segments."""
+        return f"{self.prefix}.index.json"
+
+    def unpublished(self) -> tuple:
+        """
+        Returns ([(name, size)] for segments the remote does not fully have yet, manifest),
+        taken together so the manifest describes exactly the bytes being shipped.
+        """
+        with self._lock:
+            pending = [(s["name"], s["bytes"]) for s in self.segments if s["published_bytes"] < s["bytes"]]
+            manifest = {"segments": [{"name": s["name"], "bytes": s["bytes"], "sealed": s["sealed"]} for s in self.segments]}
+            return pending, manifest
+
+    def read(self, name: str, size: int) -> str:
+        with open(self._path(name), "rb") as f:
+            return f.read(size).decode("utf-8")
+
+    def mark_published(self, sizes: dict):
+        with self._lock:
+            for segment in self.segments:
+                if segment["name"] in sizes:
+                    segment["published_bytes"] = max(segment["published_bytes"], sizes[segment["name"]])
+            self._save_index()
+
+
+class GistPublisher:
+    """
+    Ships segments to a GitHub Gist (or anything speaking the same PATCH API).
+
+    Each publish sends only segments with unpublished bytes plus the small manifest, in a
+    single PATCH. Sealed segments are sent once; the active one is bounded by the segment
+    size, so the cost of a publish no longer grows with the graph's history.
+    """
+
+    def __init__(self, api_url: str, headers: dict, timeout: float = 10):
+        self.api_url = api_url
+        self.headers = headers
+        self.timeout = timeout
+        self._lock = threading.Lock()
+
+    def publish(self, store: SegmentStore) -> int:
+        """Returns the number of segments shipped; raises requests exceptions on failure."""
+        with self._lock:
+            pending, manifest = store.unpublished()
+            if not pending:
+                return 0
+            files = {name: {"content": store.read(name, size)} for name, size in pending}
+            files[store.manifest_name] = {"content": json.dumps(manifest, indent=1)}
+            response = requests.patch(self.api_url, headers=self.headers, json={"files": files}, timeout=self.timeout)
+            response.raise_for_status()
+            store.mark_published(dict(pending))
+            return len(pending)
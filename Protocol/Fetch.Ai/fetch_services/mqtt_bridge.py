@@ -0,0 +1,67 @@
+import asyncio
+import threading
+from collections import deque
+
+
+class MqttBridge:
+    """
+    Hands readings from the paho network thread to the agent's event loop.
+    put() only wakes the loop (via call_soon_threadsafe) when the buffer goes from empty
+    to non-empty; the consumer then drains everything buffered at once and keeps only the
+    newest reading per device. The buffer is capped at high_water_mark.
+    """
+
+    def __init__(self, high_water_mark: int, drop_policy: str):
+        self.high_water_mark = high_water_mark
+        self.drop_policy = drop_policy
+        self.dropped = 0
+        self.coalesced = 0
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._ready = None
+        self._wakeup_scheduled = False
+        self._task = None
+
+    def put(self, reading):
+        """Called from the MQTT thread."""
+        with self._lock:
+            if len(self._buffer) >= self.high_water_mark:
+                self.dropped += 1
+                if self.drop_policy == "newest": return
+                self._buffer.popleft()
+            self._buffer.append(reading)
+            if self._loop is None or self._wakeup_scheduled: return
+            self._wakeup_scheduled = True
+        self._loop.call_soon_threadsafe(self._ready.set)
+
+    def drain(self) -> list:
+        with self._lock:
+            batch = list(self._buffer)
+            self._buffer.clear()
+            self._wakeup_scheduled = False
+        latest = {}
+        for reading in batch:
+            latest.pop(reading.device_id, None)
+            latest[reading.device_id] = reading
+        self.coalesced += len(batch) - len(latest)
+        return list(latest.values())
+
+    def start(self, handler, logger):
+        """Attaches to the running loop and consumes readings with `await handler(reading)`."""
+        with self._lock:
+            self._ready = asyncio.Event()
+            self._loop = asyncio.get_running_loop()
+        self._ready.set()  # drain anything received before the loop was attached
+        self._task = asyncio.create_task(self._run(handler, logger))
+
+    async def _run(self, handler, logger):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            batch = self.drain()
+            if batch:
+                logger.info(f"Drained {len(batch)} reading(s) from MQTT (coalesced={self.coalesced}, dropped={self.dropped})")
+            for reading in batch:
+                try: await handler(reading)
+                except Exception as e: logger.error(f"Error processing MQTT reading: {e}")
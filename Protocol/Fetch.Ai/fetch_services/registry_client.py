@@ -0,0 +1,119 @@
+import asyncio
+import json
+import os
+from typing import Dict, Optional
+
+import aiohttp
+import requests
+
+
+class RegistryClient:
+    """
+    Local copy of the sensor registry. Every lookup is served from memory; the copy is
+    refreshed in the background with the API's delta endpoint (or a conditional GET)
+    and, given a cache_file, persisted to disk so a restart does not depend on the API
+    being reachable. Used by the device nodes and the notary.
+    """
+
+    def __init__(self, base_url: str, cache_file: Optional[str] = None):
+        self.base_url = base_url
+        self.cache_file = cache_file
+        self.registry: Dict[str, dict] = {}
+        self.etag = None
+        self.revision = 0  # bumped locally whenever the copy changes
+
+    def get(self, mac_address: str):
+        return self.registry.get(mac_address)
+
+    def __contains__(self, mac_address: str) -> bool:
+        return mac_address in self.registry
+
+    @property
+    def notary_address(self):
+        return self.registry.get("_network_services", {}).get("notary_agent_address")
+
+    def _server_position(self):
+        # ETag is "<epoch>-<version>" as issued by the backend registry cache
+        try:
+            epoch, version = self.etag.strip('"').rsplit("-", 1)
+            return epoch, int(version)
+        except (AttributeError, ValueError):
+            return None, None
+
+    def _replace(self, registry: dict, etag):
+        changed = registry != self.registry
+        self.registry, self.etag = registry, etag
+        if changed: self.revision += 1
+        return changed
+
+    def load_from_disk(self) -> bool:
+        if self.cache_file is None:
+            return False
+        try:
+            with open(self.cache_file, "r") as f:
+                cached = json.load(f)
+            self._replace(cached["registry"], cached.get("etag"))
+            print(f"✅ Loaded {len(self.registry)} registry entries from {self.cache_file}")
+            return True
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def save_to_disk(self):
+        if self.cache_file is None:
+            return
+        tmp_path = f"{self.cache_file}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump({"etag": self.etag, "registry": self.registry}, f)
+            os.replace(tmp_path, self.cache_file)
+        except OSError as e:
+            print(f"⚠️ Could not persist registry cache: {e}")
+
+    def fetch(self) -> bool:
+        """Blocking full fetch, only used once at startup before the agent loop runs."""
+        headers = {"If-None-Match": self.etag} if self.etag and self.registry else {}
+        try:
+            response = requests.get(f"{self.base_url}/registry", headers=headers, timeout=10)
+            if response.status_code != 304:
+                response.raise_for_status()
+                self._replace(response.json(), response.headers.get("ETag"))
+                self.save_to_disk()
+            print("✅ Successfully fetched registry from API.")
+            return True
+        except requests.exceptions.RequestException as e:
+            print(f"⚠️ Could not fetch registry from API: {e}")
+            return False
+
+    async def refresh(self, session: aiohttp.ClientSession) -> bool:
+        """Pulls changes from the API without blocking the event loop. Returns True if the copy changed."""
+        epoch, version = self._server_position()
+        if epoch is not None and self.registry:
+            params = {"since": version, "epoch": epoch}
+            async with session.get(f"{self.base_url}/registry/changes", params=params, timeout=10) as resp:
+                if resp.status != 404:
+                    resp.raise_for_status()
+                    delta = await resp.json()
+                    return await self._apply_delta(delta)
+        # Older API without the delta endpoint: fall back to a conditional GET
+        headers = {"If-None-Match": self.etag} if self.etag and self.registry else {}
+        async with session.get(f"{self.base_url}/registry", headers=headers, timeout=10) as resp:
+            if resp.status == 304: return False
+            resp.raise_for_status()
+            changed = self._replace(await resp.json(), resp.headers.get("ETag"))
+        if changed: await asyncio.to_thread(self.save_to_disk)
+        return changed
+
+    async def _apply_delta(self, delta: dict) -> bool:
+        etag = f'"{delta["epoch"]}-{delta["version"]}"'
+        if delta.get("reset"):
+            changed = self._replace(delta["registry"], etag)
+        else:
+            changed = bool(delta["added"] or delta["modified"] or delta["removed"])
+            registry = self.registry
+            if changed:
+                registry = dict(self.registry)
+                registry.update(delta["added"]); registry.update(delta["modified"])
+                for mac in delta["removed"]: registry.pop(mac, None)
+            self._replace(registry, etag)
+        if changed: await asyncio.to_thread(self.save_to_disk)
+        return changed
@@ -4,7 +4,6 @@ import asyncio
 import sys
 import os
 import threading
-import queue
 
 # --- Path Configuration ---
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -13,6 +12,7 @@ SENSOR_REGISTRY_FILE = os.path.join(PROJECT_ROOT, "sensor_registry.json")
 
 # This absolute import will now work correctly with the updated schema
 from fetch_services.agents.schemas import SensorData
+from fetch_services.mqtt_bridge import MqttBridge
 
 if len(sys.argv) < 2:
     print("Usage: python esp32_gateway.py <mac_address>")
@@ -36,7 +36,10 @@ MQTT_BROKER = "broker.hivemq.com"
 MQTT_PORT = 1883
 MQTT_TOPIC_PREFIX = "echonet/sensors"
 
-message_queue = queue.Queue()
+MQTT_HIGH_WATER_MARK = 256  # readings buffered before the drop policy applies
+MQTT_DROP_POLICY = "oldest"  # "oldest" or "newest" reading is dropped past the mark
+
+message_queue = MqttBridge(MQTT_HIGH_WATER_MARK, MQTT_DROP_POLICY)
 
 from uagents import Agent, Context
 
@@ -49,13 +52,12 @@ sender_agent = Agent(
     port=gateway_agent_port
 )
 
-@sender_agent.on_interval(period=0.1)
-async def process_message_queue(ctx: Context):
-    """Periodically checks the queue for new messages and forwards them."""
-    if not message_queue.empty():
-        destination, message = message_queue.get()
-        print(f"[{sender_agent.name}] Forwarding message from queue to {destination}")
-        await ctx.send(destination, message)
+@sender_agent.on_event("startup")
+async def start_mqtt_bridge(ctx: Context):
+    """Forwards every buffered reading to the device agent as soon as MQTT delivers it."""
+    async def forward(sensor_data):
+        await ctx.send(AGENT_ADDRESS, sensor_data)
+    message_queue.start(forward, ctx.logger)
 
 def run_sender_agent():
     """Function to run the agent's event loop."""
@@ -77,7 +79,7 @@ def on_message(client, userdata, msg):
         payload = json.loads(msg.payload.decode())
         # The gateway now expects the new, simplified SensorData format
         sensor_data = SensorData(**payload)
-        message_queue.put((AGENT_ADDRESS, sensor_data))
+        message_queue.put(sensor_data)
     except Exception as e:
         print(f"Error processing message: {e}")
 
@@ -6,7 +6,7 @@
 
 import sys
 import threading
-import queue
+from collections import deque
 import paho.mqtt.client as mqtt
 import asyncio
 import hashlib
@@ -116,15 +116,91 @@ class SmartConsensus:
 # ======================================================================================
 # --- Main Application & Agent Logic ---
 # ======================================================================================
-message_queue = queue.Queue()
+MQTT_HIGH_WATER_MARK = 256  # readings buffered before the drop policy applies
+MQTT_DROP_POLICY = "oldest"  # "oldest" or "newest" reading is dropped past the mark
+
+class MqttBridge:
+    """
+    Hands readings from the paho network thread to the agent's event loop.
+    put() only wakes the loop (via call_soon_threadsafe) when the buffer goes from empty
+    to non-empty; the consumer then drains everything buffered at once and keeps only the
+    newest reading per device. The buffer is capped at high_water_mark.
+    """
+
+    def __init__(self, high_water_mark: int, drop_policy: str):
+        self.high_water_mark = high_water_mark
+        self.drop_policy = drop_policy
+        self.dropped = 0
+        self.coalesced = 0
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._ready = None
+        self._wakeup_scheduled = False
+        self._task = None
+
+    def put(self, reading):
+        """Called from the MQTT thread."""
+        with self._lock:
+            if len(self._buffer) >= self.high_water_mark:
+                self.dropped += 1
+                if self.drop_policy == "newest": return
+                self._buffer.popleft()
+            self._buffer.append(reading)
+            if self._loop is None or self._wakeup_scheduled: return
+            self._wakeup_scheduled = True
+        self._loop.call_soon_threadsafe(self._ready.set)
+
+    def drain(self) -> list:
+        with self._lock:
+            batch = list(self._buffer)
+            self._buffer.clear()
+            self._wakeup_scheduled = False
+        latest = {}
+        for reading in batch:
+            latest.pop(reading.device_id, None)
+            latest[reading.device_id] = reading
+        self.coalesced += len(batch) - len(latest)
+        return list(latest.values())
+
+    def start(self, handler, logger):
+        """Attaches to the running loop and consumes readings with `await handler(reading)`."""
+        with self._lock:
+            self._ready = asyncio.Event()
+            self._loop = asyncio.get_running_loop()
+        self._ready.set()  # drain anything received before the loop was attached
+        self._task = asyncio.create_task(self._run(handler, logger))
+
+    async def _run(self, handler, logger):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            batch = self.drain()
+            if batch:
+                logger.info(f"Drained {len(batch)} reading(s) from MQTT (coalesced={self.coalesced}, dropped={self.dropped})")
+            for reading in batch:
+                try: await handler(reading)
+                except Exception as e: logger.error(f"Error processing MQTT reading: {e}")
+
+message_queue = MqttBridge(MQTT_HIGH_WATER_MARK, MQTT_DROP_POLICY)
 NOTARY_AGENT_ADDRESS = None
 
+REGISTRY_ETAG = None
+REGISTRY_DATA = None
+
 def read_registry():
+    # Conditional GET: the API answers 304 with an empty body while the registry is unchanged
+    global REGISTRY_ETAG, REGISTRY_DATA
+    headers = {"If-None-Match": REGISTRY_ETAG} if REGISTRY_ETAG and REGISTRY_DATA is not None else {}
     try:
-        response = requests.get(f"{API_BASE_URL}/registry", timeout=10)
+        response = requests.get(f"{API_BASE_URL}/registry", headers=headers, timeout=10)
+        if response.status_code == 304:
+            return REGISTRY_DATA
         response.raise_for_status()
         print("✅ Successfully fetched registry from API.")
-        return response.json()
+        REGISTRY_DATA = response.json()
+        REGISTRY_ETAG = response.headers.get("ETag")
+        return REGISTRY_DATA
     except requests.exceptions.RequestException as e:
         print(f"❌ CRITICAL: Could not fetch registry from API: {e}. Exiting.")
         sys.exit(1)
@@ -370,15 +446,9 @@ if __name__ == "__main__":
     validation_protocol.on_message(model=ValidationRequest, replies=set())(lambda ctx, sender, msg: handle_validation_request(ctx, sender, msg, CONFIG, private_key, public_key))
     validation_protocol.on_message(model=ValidationResponse, replies=set())(handle_validation_response)
 
-    @agent.on_interval(period=0.5)
-    async def process_mqtt_queue(ctx: Context):
-        if not message_queue.empty():
-            try:
-                sensor_data = message_queue.get_nowait()
-                ctx.logger.info(f"Pulled sensor data from MQTT queue for device: {sensor_data.device_id}")
-                await handle_sensor_data(ctx, agent.address, sensor_data, agent, CONFIG, private_key, public_key)
-            except queue.Empty: pass
-            except Exception as e: ctx.logger.error(f"Error processing item from queue: {e}")
+    @agent.on_event("startup")
+    async def start_mqtt_bridge(ctx: Context):
+        message_queue.start(lambda sensor_data: handle_sensor_data(ctx, agent.address, sensor_data, agent, CONFIG, private_key, public_key), ctx.logger)
 
     agent.include(validation_protocol)
     
@@ -0,0 +1,55 @@
+"""
+Benchmark: /ingest throughput with the MAC-keyed DeviceStore vs. the old linear list scan.
+
+Each run pre-loads N devices and then times updates of randomly chosen existing devices.
+    python bench_ingest.py
+"""
+import random
+import time
+
+from index import EnrichedPacket, packet_to_device_data, ingest_enriched_packet, submitted_data
+
+DEVICE_COUNTS = (1_000, 10_000, 100_000)
+INGESTS_PER_RUN = 2_000
+
+
+def mac_for(i: int) -> str:
+    return ":".join(f"{(i >> shift) & 0xFF:02x}" for shift in (40, 32, 24, 16, 8, 0))
+
+
+def make_packet(i: int) -> EnrichedPacket:
+    return EnrichedPacket(mac_address=mac_for(i), latitude=28.6, longitude=77.2, decibel_level=random.uniform(30, 120))
+
+
+def legacy_ingest(store: list, packet: EnrichedPacket):
+    device_data = packet_to_device_data(packet)
+    for existing in store:
+        if existing.get("mac_address") == packet.mac_address:
+            existing.update(device_data)
+            return
+    store.append(device_data)
+
+
+def run(num_devices: int):
+    rng = random.Random(num_devices)
+    packets = [make_packet(rng.randrange(num_devices)) for _ in range(INGESTS_PER_RUN)]
+
+    legacy_store = [packet_to_device_data(make_packet(i)) for i in range(num_devices)]
+    start = time.perf_counter()
+    for packet in packets:
+        legacy_ingest(legacy_store, packet)
+    legacy_rate = INGESTS_PER_RUN / (time.perf_counter() - start)
+
+    submitted_data.upsert_many(packet_to_device_data(make_packet(i)) for i in range(num_devices))
+    start = time.perf_counter()
+    for packet in packets:
+        ingest_enriched_packet(packet)
+    indexed_rate = INGESTS_PER_RUN / (time.perf_counter() - start)
+
+    print(f"{num_devices:>8} {legacy_rate:>14,.0f} {indexed_rate:>14,.0f} {indexed_rate / legacy_rate:>8.1f}x")
+
+
+if __name__ == "__main__":
+    print(f"{'devices':>8} {'list (req/s)':>14} {'dict (req/s)':>14} {'speedup':>8}")
+    for count in DEVICE_COUNTS:
+        run(count)
@@ -0,0 +1,91 @@
+"""
+Packed columnar wire format for large listings.
+
+Layout (all little-endian):
+    header   magic b"ECN1", uint32 row count, uint32 column count
+    columns  per column: 16-byte ASCII name (NUL padded), uint8 type, 3 pad bytes,
+             uint32 byte length
+    bodies   each column's bytes in descriptor order, padded to a 4-byte boundary
+
+Types: 1 = float32, 2 = uint32, 3 = utf8 strings (uint32 offsets, row_count + 1 of them,
+followed by the concatenated bytes). A browser can map every numeric column straight
+onto a Float32Array/Uint32Array without parsing.
+"""
+import struct
+import sys
+from array import array
+from typing import Dict, List, Tuple, Union
+
+MEDIA_TYPE = "application/vnd.echonet.columnar"
+MAGIC = b"ECN1"
+
+FLOAT32 = 1
+UINT32 = 2
+UTF8 = 3
+
+_TYPE_CODES = {FLOAT32: "f", UINT32: "I"}
+
+Column = Tuple[str, int, Union[array, Tuple[array, bytes]]]
+
+
+def wants_columnar(accept_header: str) -> bool:
+    """True when the client's Accept header asks for the packed columnar format."""
+    return MEDIA_TYPE in (accept_header or "")
+
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder == "little":
+        return values.tobytes()
+    swapped = array(values.typecode, values)
+    swapped.byteswap()
+    return swapped.tobytes()
+
+
+def _pad(length: int) -> bytes:
+    return b"\0" * (-length % 4)
+
+
+def encode_columns(row_count: int, columns: List[Column]) -> bytes:
+    """Encodes [(name, type, data)] where data is an array, or (offsets, blob) for UTF8."""
+    descriptors = [MAGIC, struct.pack("<II", row_count, len(columns))]
+    bodies = []
+    for name, column_type, data in columns:
+        if column_type == UTF8:
+            offsets, blob = data
+            body = _little_endian(offsets) + bytes(blob)
+        else:
+            body = _little_endian(data)
+        descriptors.append(struct.pack("<16sB3xI", name.encode("ascii"), column_type, len(body)))
+        bodies.append(body + _pad(len(body)))
+    return b"".join(descriptors + bodies)
+
+
+def decode_columns(payload: bytes) -> Dict[str, list]:
+    """Inverse of encode_columns, for Python clients and debugging."""
+    if payload[:4] != MAGIC:
+        raise ValueError("Not an EchoNet columnar payload")
+    row_count, column_count = struct.unpack_from("<II", payload, 4)
+    offset = 12
+    descriptors = []
+    for _ in range(column_count):
+        name, column_type, length = struct.unpack_from("<16sB3xI", payload, offset)
+        descriptors.append((name.rstrip(b"\0").decode("ascii"), column_type, length))
+        offset += 24
+    result = {}
+    for name, column_type, length in descriptors:
+        body = payload[offset:offset + length]
+        offset += length + (-length % 4)
+        if column_type == UTF8:
+            offsets = array("I")
+            offsets.frombytes(body[:4 * (row_count + 1)])
+            if sys.byteorder != "little":
+                offsets.byteswap()
+            blob = body[4 * (row_count + 1):]
+            result[name] = [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(row_count)]
+        else:
+            values = array(_TYPE_CODES[column_type])
+            values.frombytes(body)
+            if sys.byteorder != "little":
+                values.byteswap()
+            result[name] = values.tolist()
+    return result
@@ -0,0 +1,156 @@
+import threading
+from array import array
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from columnar import FLOAT32, UINT32, UTF8
+
+
+def parse_timestamp(value) -> float:
+    """Parse an epoch-seconds number or ISO 8601 string into epoch seconds"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+
+
+class DeviceColumns:
+    """Packed per-field columns mirroring the store rows, for zero-copy binary listings."""
+
+    def __init__(self):
+        self.mac_offsets = array("I", [0])
+        self.mac_blob = bytearray()
+        self.latitude = array("f")
+        self.longitude = array("f")
+        self.decibel = array("f")
+        self.timestamp = array("I")
+
+    @staticmethod
+    def _values(device_data: Dict[str, Any]) -> Tuple[float, float, float, int]:
+        location = device_data.get("location") or {}
+        try:
+            timestamp = int(parse_timestamp(device_data.get("timestamp")))
+        except (TypeError, ValueError, OverflowError):
+            timestamp = 0
+        return (
+            location.get("latitude", float("nan")),
+            location.get("longitude", float("nan")),
+            device_data.get("decibel") or 0.0,
+            min(max(timestamp, 0), 0xFFFFFFFF),
+        )
+
+    def append(self, device_data: Dict[str, Any]):
+        self.mac_blob += device_data["mac_address"].encode("utf-8")
+        self.mac_offsets.append(len(self.mac_blob))
+        lat, lng, db, ts = self._values(device_data)
+        self.latitude.append(lat)
+        self.longitude.append(lng)
+        self.decibel.append(db)
+        self.timestamp.append(ts)
+
+    def set(self, row: int, device_data: Dict[str, Any]):
+        lat, lng, db, ts = self._values(device_data)
+        self.latitude[row] = lat
+        self.longitude[row] = lng
+        self.decibel[row] = db
+        self.timestamp[row] = ts
+
+    def snapshot(self) -> list:
+        # Slicing copies packed buffers with memcpy; no per-row objects are created
+        return [
+            ("mac_address", UTF8, (self.mac_offsets[:], bytes(self.mac_blob))),
+            ("latitude", FLOAT32, self.latitude[:]),
+            ("longitude", FLOAT32, self.longitude[:]),
+            ("decibel", FLOAT32, self.decibel[:]),
+            ("timestamp", UINT32, self.timestamp[:]),
+        ]
+
+
+class DeviceStore:
+    """
+    Latest reading per device, keyed by MAC address.
+
+    Lookups and upserts are O(1). `values()` returns an insertion-ordered list view that
+    is maintained alongside the dict, so listing endpoints do not rebuild it per request.
+    Records are updated in place, matching the old list-of-dicts behaviour. A packed
+    columnar mirror (DeviceColumns) is kept in the same row order for binary listings.
+    If `journal` is set, every stored record is passed to it under the store lock, so the
+    journal sees writes in exactly the order they were applied.
+    """
+
+    def __init__(self, journal: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.journal = journal
+        self._by_mac: Dict[str, Dict[str, Any]] = {}
+        self._rows: Dict[str, int] = {}
+        self._ordered: List[Dict[str, Any]] = []
+        self._columns = DeviceColumns()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ordered)
+
+    def __contains__(self, mac_address: str) -> bool:
+        return mac_address in self._by_mac
+
+    def get(self, mac_address: str) -> Optional[Dict[str, Any]]:
+        return self._by_mac.get(mac_address)
+
+    def values(self) -> List[Dict[str, Any]]:
+        return self._ordered
+
+    def columns(self) -> Tuple[int, list]:
+        """Returns (row count, columns) ready for columnar.encode_columns."""
+        with self._lock:
+            return len(self._ordered), self._columns.snapshot()
+
+    def snapshot(self, on_snapshot: Optional[Callable[[], None]] = None) -> List[Dict[str, Any]]:
+        """Copies every record; `on_snapshot` runs while writes are blocked."""
+        with self._lock:
+            if on_snapshot is not None:
+                on_snapshot()
+            return [dict(record) for record in self._ordered]
+
+    def upsert(self, device_data: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """Insert or update one device. Returns (stored record, is_update)."""
+        with self._lock:
+            return self._upsert(device_data)
+
+    def apply(self, device_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Upsert without journaling, for records that are already persisted elsewhere."""
+        with self._lock:
+            return self._upsert(device_data, journal=False)[0]
+
+    def upsert_many(self, device_batch: Iterable[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+        """
+        Insert or update many devices under one lock acquisition. Returns (a copy of each
+        stored record as it was right after its upsert, {"inserted": n, "updated": n}).
+        """
+        records = []
+        inserted = updated = 0
+        with self._lock:
+            for device_data in device_batch:
+                record, is_update = self._upsert(device_data)
+                records.append(dict(record))
+                if is_update:
+                    updated += 1
+                else:
+                    inserted += 1
+        return records, {"inserted": inserted, "updated": updated}
+
+    def _upsert(self, device_data: Dict[str, Any], journal: bool = True) -> Tuple[Dict[str, Any], bool]:
+        mac_address = device_data["mac_address"]
+        existing = self._by_mac.get(mac_address)
+        if existing is not None:
+            existing.update(device_data)
+            self._columns.set(self._rows[mac_address], existing)
+            if journal and self.journal is not None:
+                self.journal(existing)
+            return existing, True
+        record = dict(device_data)
+        self._by_mac[mac_address] = record
+        self._rows[mac_address] = len(self._ordered)
+        self._ordered.append(record)
+        self._columns.append(record)
+        if journal and self.journal is not None:
+            self.journal(record)
+        return record, False
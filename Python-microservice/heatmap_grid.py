@@ -0,0 +1,164 @@
+import math
+import threading
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from columnar import FLOAT32, UINT32
+
+MAX_MERCATOR_LATITUDE = 85.05112878
+
+
+def tile_for(latitude: float, longitude: float, zoom: int) -> Tuple[int, int]:
+    """Web-mercator (slippy map) tile x/y containing the point at `zoom`."""
+    n = 1 << zoom
+    latitude = max(-MAX_MERCATOR_LATITUDE, min(MAX_MERCATOR_LATITUDE, latitude))
+    x = int((longitude + 180.0) / 360.0 * n)
+    lat_rad = math.radians(latitude)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+class Cell:
+    """Running aggregate for one grid cell. Members are kept so max survives removals."""
+
+    __slots__ = ("members", "sum_db", "sum_lat", "sum_lng", "max_db")
+
+    def __init__(self):
+        self.members: Dict[str, float] = {}
+        self.sum_db = 0.0
+        self.sum_lat = 0.0
+        self.sum_lng = 0.0
+        self.max_db: Optional[float] = None
+
+    def add(self, mac_address: str, latitude: float, longitude: float, decibel: float):
+        self.members[mac_address] = decibel
+        self.sum_db += decibel
+        self.sum_lat += latitude
+        self.sum_lng += longitude
+        if self.max_db is not None and decibel > self.max_db:
+            self.max_db = decibel
+
+    def remove(self, mac_address: str, latitude: float, longitude: float, decibel: float):
+        del self.members[mac_address]
+        self.sum_db -= decibel
+        self.sum_lat -= latitude
+        self.sum_lng -= longitude
+        if decibel == self.max_db:
+            self.max_db = None  # recomputed lazily on the next read
+
+    def summary(self) -> dict:
+        count = len(self.members)
+        if self.max_db is None:
+            self.max_db = max(self.members.values())
+        return {
+            "lat": round(self.sum_lat / count, 5),
+            "lng": round(self.sum_lng / count, 5),
+            "value": round(self.sum_db / count, 1),
+            "max": round(self.max_db, 1),
+            "count": count,
+        }
+
+
+class HeatmapGrid:
+    """
+    Per-zoom grid of pre-aggregated cells (count, mean dB, max dB, mean position).
+
+    Cells at zoom z are web-mercator tiles at z + cell_zoom_offset, so each map tile is
+    split into 2**offset x 2**offset cells. Every ingest moves one device between cells
+    in O(levels), and a viewport query touches only the cells inside its bbox.
+    """
+
+    def __init__(self, zoom_levels=(2, 4, 6, 8, 10, 12), cell_zoom_offset: int = 3):
+        self.zoom_levels = tuple(sorted(zoom_levels))
+        self.cell_zoom_offset = cell_zoom_offset
+        self.cells: Dict[int, Dict[Tuple[int, int], Cell]] = {z: {} for z in self.zoom_levels}
+        self.devices: Dict[str, Tuple[float, float, float]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.devices)
+
+    def update(self, mac_address: str, latitude: float, longitude: float, decibel: float) -> Optional[Tuple[float, float, float]]:
+        """Moves the device into its cells; returns its previous (lat, lng, dB), if any."""
+        with self._lock:
+            previous = self.devices.get(mac_address)
+            if previous == (latitude, longitude, decibel):
+                return previous
+            if previous is not None:
+                self._remove(mac_address, *previous)
+            self.devices[mac_address] = (latitude, longitude, decibel)
+            for zoom in self.zoom_levels:
+                key = tile_for(latitude, longitude, zoom + self.cell_zoom_offset)
+                cell = self.cells[zoom].get(key)
+                if cell is None:
+                    cell = self.cells[zoom][key] = Cell()
+                cell.add(mac_address, latitude, longitude, decibel)
+            return previous
+
+    def remove(self, mac_address: str):
+        with self._lock:
+            previous = self.devices.pop(mac_address, None)
+            if previous is not None:
+                self._remove(mac_address, *previous)
+
+    def _remove(self, mac_address: str, latitude: float, longitude: float, decibel: float):
+        for zoom in self.zoom_levels:
+            key = tile_for(latitude, longitude, zoom + self.cell_zoom_offset)
+            cell = self.cells[zoom][key]
+            cell.remove(mac_address, latitude, longitude, decibel)
+            if not cell.members:
+                del self.cells[zoom][key]
+
+    def level_for(self, zoom: float) -> int:
+        """The finest maintained level not finer than the requested map zoom."""
+        candidates = [z for z in self.zoom_levels if z <= zoom]
+        return candidates[-1] if candidates else self.zoom_levels[0]
+
+    def cell_at(self, level: int, latitude: float, longitude: float) -> Tuple[str, dict]:
+        """Returns ("level/x/y", summary) for the cell containing the point; count 0 if empty."""
+        x, y = tile_for(latitude, longitude, level + self.cell_zoom_offset)
+        with self._lock:
+            cell = self.cells[level].get((x, y))
+            summary = cell.summary() if cell is not None else {"count": 0}
+        return f"{level}/{x}/{y}", summary
+
+    def _select(self, bbox: Tuple[float, float, float, float], level: int) -> List[Cell]:
+        # Caller holds _lock
+        min_lng, min_lat, max_lng, max_lat = bbox
+        if min_lng > max_lng:
+            # Viewport crosses the antimeridian
+            return self._select((min_lng, min_lat, 180.0, max_lat), level) + \
+                self._select((-180.0, min_lat, max_lng, max_lat), level)
+        cell_zoom = level + self.cell_zoom_offset
+        x0, y0 = tile_for(max_lat, min_lng, cell_zoom)  # mercator y grows southwards
+        x1, y1 = tile_for(min_lat, max_lng, cell_zoom)
+        cells = self.cells[level]
+        if (x1 - x0 + 1) * (y1 - y0 + 1) < len(cells):
+            keys = ((x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1))
+            return [cells[key] for key in keys if key in cells]
+        return [cell for (x, y), cell in cells.items() if x0 <= x <= x1 and y0 <= y <= y1]
+
+    def query(self, bbox: Tuple[float, float, float, float], zoom: float) -> Tuple[int, List[dict]]:
+        """Returns (level, cells) for bbox = (min_lng, min_lat, max_lng, max_lat)."""
+        level = self.level_for(zoom)
+        with self._lock:
+            return level, [cell.summary() for cell in self._select(bbox, level)]
+
+    def query_columns(self, bbox: Tuple[float, float, float, float], zoom: float) -> Tuple[int, int, list]:
+        """Like query, but returns (level, row count, columns) for columnar.encode_columns."""
+        level = self.level_for(zoom)
+        lat, lng, value, max_db, count = array("f"), array("f"), array("f"), array("f"), array("I")
+        with self._lock:
+            selected = self._select(bbox, level)
+            for cell in selected:
+                n = len(cell.members)
+                if cell.max_db is None:
+                    cell.max_db = max(cell.members.values())
+                lat.append(cell.sum_lat / n)
+                lng.append(cell.sum_lng / n)
+                value.append(cell.sum_db / n)
+                max_db.append(cell.max_db)
+                count.append(n)
+        columns = [("lat", FLOAT32, lat), ("lng", FLOAT32, lng), ("value", FLOAT32, value),
+                   ("max", FLOAT32, max_db), ("count", UINT32, count)]
+        return level, len(selected), columns
@@ -1,17 +1,60 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict, Any
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError
+from typing import List, Dict, Any, Optional
+import asyncio
 import random
 import json
 from datetime import datetime
 import os
 
+from columnar import MEDIA_TYPE as COLUMNAR_MEDIA_TYPE, encode_columns, wants_columnar
+from device_store import DeviceStore, parse_timestamp
+from timeseries import SeriesStore
+from heatmap_grid import HeatmapGrid
+from live_stream import StreamHub, Subscriber
+from storage import MemoryStorage, storage_from_env
+from shared_state import RedisSharedState
+
 app = FastAPI(title="Fluence Python Worker", description="Device data collection and visualization API")
 
-# Store for submitted device data
-submitted_data = []
+# Store for submitted device data, keyed by MAC address
+submitted_data = DeviceStore()
+
+# Durable log + snapshot behind submitted_data (STORAGE_BACKEND=memory disables it)
+storage = storage_from_env()
+
+# With SHARED_STATE_URL (redis://...) every worker process mirrors the device records kept
+# in Redis, so the worker can run with WEB_CONCURRENCY > 1. Redis then owns persistence.
+SHARED_STATE_URL = os.environ.get("SHARED_STATE_URL")
+shared_state = RedisSharedState(SHARED_STATE_URL) if SHARED_STATE_URL else None
+if shared_state is not None:
+    storage = MemoryStorage()
+
+# Per-device history: raw readings plus 1-minute and 1-hour roll-ups. Snapshotted by the log
+# storage; with SHARED_STATE_URL only the latest reading per device survives a restart.
+series_store = SeriesStore(
+    raw_capacity=int(os.environ.get("SERIES_RAW_CAPACITY", "1000")),
+    minute_capacity=int(os.environ.get("SERIES_MINUTE_BUCKETS", "1440")),
+    hour_capacity=int(os.environ.get("SERIES_HOUR_BUCKETS", "720")),
+)
+SERIES_MAX_POINTS = 500
+
+# Pre-aggregated heatmap cells per zoom level, maintained on ingest
+heatmap_grid = HeatmapGrid()
+
+# Live /stream subscribers (SSE and WebSocket)
+stream_hub = StreamHub()
+STREAM_MAX_BUFFER = int(os.environ.get("STREAM_MAX_BUFFER", "1000"))
+STREAM_KEEPALIVE_SECONDS = 15.0
+
+# Synthetic sample devices are mixed into /data and /heatmap/data only in demo mode.
+# The pool is generated once and regenerated on a timer, never per request.
+DEMO_DATA = os.environ.get("DEMO_DATA", "false").lower() in ("1", "true", "yes")
+DEMO_POOL_SIZE = int(os.environ.get("DEMO_POOL_SIZE", "30"))
+DEMO_REFRESH_SECONDS = float(os.environ.get("DEMO_REFRESH_SECONDS", "60"))
 
 # Allow CORS for local frontend/dev. In production, lock this down to the frontend origin(s).
 app.add_middleware(
@@ -42,6 +85,22 @@ class EnrichedPacket(BaseModel):
     timestamp: str = None
     metadata: Dict[str, Any] = {}
 
+def record_history(device_data: Dict[str, Any], replayed: bool = False):
+    """Append an ingested reading to the device's time series"""
+    try:
+        timestamp = parse_timestamp(device_data["timestamp"])
+    except ValueError:
+        timestamp = datetime.now().timestamp()
+    series_store.record(device_data["mac_address"], timestamp, device_data["decibel"], replayed)
+
+def after_ingest(device_data: Dict[str, Any], replayed: bool = False):
+    """Update every derived view (history, heatmap cells, live streams) for an ingested reading"""
+    record_history(device_data, replayed)
+    location = device_data.get("location") or {}
+    if "latitude" in location and "longitude" in location:
+        previous = heatmap_grid.update(device_data["mac_address"], location["latitude"], location["longitude"], device_data["decibel"])
+        stream_hub.publish(device_data, previous, heatmap_grid)
+
 def generate_device_data():
     """Generate realistic device sensor data"""
     cities = [
@@ -80,9 +139,77 @@ def generate_device_data():
         "city": city
     }
 
+def heatmap_point(item: Dict[str, Any], is_submitted: bool) -> Dict[str, Any]:
+    return {
+        "lat": item["location"]["latitude"],
+        "lng": item["location"]["longitude"],
+        "value": item["decibel"],
+        "device_id": item["device_id"],
+        "event": item["event"],
+        "timestamp": item["timestamp"],
+        "is_submitted": is_submitted,
+        "city": item.get("city")
+    }
+
+class SamplePool:
+    """Pre-generated demo devices, swapped as a whole so readers never see a partial pool"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.devices: List[Dict[str, Any]] = []
+        self.heatmap_points: List[Dict[str, Any]] = []
+
+    def refresh(self):
+        devices = [generate_device_data() for _ in range(self.size)]
+        points = [heatmap_point(item, False) for item in devices]
+        self.devices, self.heatmap_points = devices, points
+
+def apply_replicated(record: Dict[str, Any], replayed: bool = False):
+    """Apply a record persisted or written elsewhere, without journaling it again"""
+    after_ingest(submitted_data.apply(record), replayed)
+
+@app.on_event("startup")
+def restore_submitted_data():
+    """Replay persisted (or shared) devices into the store and derived views, then start journaling"""
+    source = shared_state or storage
+    # History snapshotted with the records first, then the log tail adds what came after
+    series_store.load(storage.open_history())
+    restored = 0
+    for record in source.open():
+        apply_replicated(record, replayed=True)
+        restored += 1
+    submitted_data.journal = source.append
+    if shared_state is not None:
+        shared_state.start(apply_replicated)
+        print(f"🔗 Sharing device state through Redis as {shared_state.origin}")
+    else:
+        storage.start(submitted_data.snapshot, series_store.dump)
+    if restored:
+        print(f"💾 Restored {len(submitted_data)} devices from {restored} persisted records")
+
+@app.on_event("shutdown")
+def close_storage():
+    if shared_state is not None:
+        shared_state.close()
+    storage.close()
+
+sample_pool = SamplePool(DEMO_POOL_SIZE if DEMO_DATA else 0)
+
+async def refresh_sample_pool():
+    while True:
+        await asyncio.sleep(DEMO_REFRESH_SECONDS)
+        sample_pool.refresh()
+
+@app.on_event("startup")
+async def start_sample_pool():
+    if DEMO_DATA:
+        sample_pool.refresh()
+        app.state.sample_pool_task = asyncio.create_task(refresh_sample_pool())
+        print(f"🎲 Demo mode: serving {DEMO_POOL_SIZE} sample devices, refreshed every {DEMO_REFRESH_SECONDS}s")
+
 @app.get("/")
 def read_root():
-    return {"message": "Fluence Python Worker is running!", "endpoints": ["/hello", "/data", "/heatmap", "/backend/"]}
+    return {"message": "Fluence Python Worker is running!", "endpoints": ["/hello", "/data", "/ingest", "/ingest/batch", "/heatmap", "/stream", "/backend/"]}
 
 @app.get("/hello")
 def hello_world():
@@ -91,40 +218,27 @@ def hello_world():
 @app.post("/data/submit")
 def submit_device_data(data: DeviceData):
     """Submit device sensor data - updates existing device if MAC address exists"""
-    data_dict = data.dict()
-    
-    # Check if device with same MAC address already exists
-    existing_device_index = None
-    for i, existing_data in enumerate(submitted_data):
-        if existing_data.get("mac_address") == data.mac_address:
-            existing_device_index = i
-            break
+    updated_data, is_update = submitted_data.upsert(data.dict())
+    after_ingest(updated_data)
     
-    if existing_device_index is not None:
-        # Update existing device data
-        submitted_data[existing_device_index].update(data_dict)
+    if is_update:
         message = f"Device data updated for MAC address {data.mac_address}"
-        updated_data = submitted_data[existing_device_index]
     else:
-        # Add new device data
-        submitted_data.append(data_dict)
         message = f"New device data added for MAC address {data.mac_address}"
-        updated_data = data_dict
     
     return {
         "status": "success", 
         "message": message,
         "data": updated_data,
         "total_submitted": len(submitted_data),
-        "is_update": existing_device_index is not None
+        "is_update": is_update
     }
 
 @app.get("/data")
 def get_all_data():
-    """Get all data (generated + submitted) for analysis"""
-    # Combine generated sample data with submitted data
-    generated = [generate_device_data() for _ in range(20)]
-    all_data = generated + submitted_data
+    """Get all data (demo samples + submitted) for analysis"""
+    generated = sample_pool.devices
+    all_data = generated + submitted_data.values()
     return {
         "total_count": len(all_data),
         "generated_count": len(generated),
@@ -132,34 +246,41 @@ def get_all_data():
         "data": all_data
     }
 
+def columnar_response(row_count: int, columns: list, **headers) -> Response:
+    """Packed little-endian columns (see columnar.py), negotiated with Accept"""
+    headers = {f"X-{name.replace('_', '-').title()}": str(value) for name, value in headers.items()}
+    return Response(content=encode_columns(row_count, columns), media_type=COLUMNAR_MEDIA_TYPE,
+                    headers={"Vary": "Accept", **headers})
+
 @app.get("/data/submitted")
-def get_submitted_data():
-    """Get only the submitted device data"""
+def get_submitted_data(request: Request):
+    """
+    Get only the submitted device data.
+    Send `Accept: application/vnd.echonet.columnar` for packed mac/latitude/longitude/decibel/timestamp columns.
+    """
+    if wants_columnar(request.headers.get("accept")):
+        row_count, columns = submitted_data.columns()
+        return columnar_response(row_count, columns)
     return {
         "count": len(submitted_data),
-        "data": submitted_data
+        "data": submitted_data.values()
     }
 
 @app.get("/data/device/{mac_address}")
 def get_device_by_mac(mac_address: str):
     """Get device data by MAC address"""
-    for device_data in submitted_data:
-        if device_data.get("mac_address") == mac_address:
-            return {
-                "found": True,
-                "data": device_data
-            }
+    device_data = submitted_data.get(mac_address)
+    if device_data is not None:
+        return {
+            "found": True,
+            "data": device_data
+        }
     
     raise HTTPException(status_code=404, detail=f"Device with MAC address {mac_address} not found")
 
-@app.post("/ingest")
-def ingest_enriched_packet(packet: EnrichedPacket):
-    """
-    Ingest enriched packet data with coordinates from external sources.
-    Updates existing device if MAC address exists, otherwise creates new entry.
-    """
-    # Convert enriched packet to device data format
-    device_data = {
+def packet_to_device_data(packet: EnrichedPacket) -> Dict[str, Any]:
+    """Convert an enriched packet to the stored device data format"""
+    return {
         "device_id": packet.device_id or f"DEVICE_{packet.mac_address.replace(':', '_')}",
         "mac_address": packet.mac_address,
         "location": {
@@ -171,26 +292,60 @@ def ingest_enriched_packet(packet: EnrichedPacket):
         "timestamp": packet.timestamp or datetime.now().isoformat(),
         "metadata": packet.metadata
     }
+
+@app.get("/data/device/{mac_address}/series")
+def get_device_series(
+    mac_address: str,
+    from_: Optional[str] = Query(None, alias="from"),
+    to: Optional[str] = None,
+    step: Optional[float] = Query(None, gt=0),
+):
+    """
+    Get a device's history between `from` and `to` (epoch seconds or ISO 8601) in `step`-second buckets.
+    Defaults to the last hour; the cheapest stored resolution covering the range is used.
+    """
+    try:
+        end_time = parse_timestamp(to) if to is not None else datetime.now().timestamp()
+        start_time = parse_timestamp(from_) if from_ is not None else end_time - 3600
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid time range: {e}")
+    if start_time > end_time:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    if step is None:
+        step = max(1.0, (end_time - start_time) / SERIES_MAX_POINTS)
+
+    result = series_store.query(mac_address, start_time, end_time, step)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"No history for device with MAC address {mac_address}")
+
+    for point in result["points"]:
+        point["timestamp"] = datetime.fromtimestamp(point.pop("t")).isoformat()
+    return {
+        "mac_address": mac_address,
+        "from": datetime.fromtimestamp(start_time).isoformat(),
+        "to": datetime.fromtimestamp(end_time).isoformat(),
+        "step": step,
+        "resolution": result["resolution"] or "raw",
+        "count": len(result["points"]),
+        "points": result["points"]
+    }
+
+@app.post("/ingest")
+def ingest_enriched_packet(packet: EnrichedPacket):
+    """
+    Ingest enriched packet data with coordinates from external sources.
+    Updates existing device if MAC address exists, otherwise creates new entry.
+    """
+    # Convert enriched packet to device data format
+    device_data = packet_to_device_data(packet)
     
-    # Check if device with same MAC address already exists
-    existing_device_index = None
-    for i, existing_data in enumerate(submitted_data):
-        if existing_data.get("mac_address") == packet.mac_address:
-            existing_device_index = i
-            break
+    updated_data, is_update = submitted_data.upsert(device_data)
+    after_ingest(updated_data)
     
-    if existing_device_index is not None:
-        # Update existing device data
-        submitted_data[existing_device_index].update(device_data)
+    if is_update:
         message = f"Device coordinates and data updated for MAC address {packet.mac_address}"
-        updated_data = submitted_data[existing_device_index]
-        is_update = True
     else:
-        # Add new device data
-        submitted_data.append(device_data)
         message = f"New device ingested for MAC address {packet.mac_address}"
-        updated_data = device_data
-        is_update = False
     
     return {
         "status": "success",
@@ -204,6 +359,90 @@ def ingest_enriched_packet(packet: EnrichedPacket):
         }
     }
 
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "5000"))
+BATCH_CHUNK_SIZE = int(os.environ.get("BATCH_CHUNK_SIZE", "500"))
+
+async def iter_batch_items(request: Request):
+    """Yield raw packet dicts from a JSON array body or an NDJSON streaming body"""
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+        if buffer.strip():
+            yield json.loads(buffer)
+    else:
+        body = await request.json()
+        if not isinstance(body, list):
+            raise HTTPException(status_code=400, detail="Batch body must be a JSON array of packets")
+        for item in body:
+            yield item
+
+def ingest_batch_chunk(items: List[Any], first_index: int):
+    """Validate, store and fan out one chunk of a batch (runs in the threadpool, off the event loop)"""
+    device_batch = []
+    errors = []
+    for offset, item in enumerate(items):
+        try:
+            device_batch.append(packet_to_device_data(EnrichedPacket(**item)))
+        except (ValidationError, TypeError) as e:
+            errors.append({"index": first_index + offset, "error": str(e)})
+    records, counts = submitted_data.upsert_many(device_batch)
+    # Derived views get the merged records, exactly as on the single-packet /ingest path
+    for record in records:
+        after_ingest(record)
+    return len(device_batch), counts, errors
+
+@app.post("/ingest/batch")
+async def ingest_enriched_batch(request: Request):
+    """
+    Ingest many enriched packets in one request.
+    Accepts a JSON array, or NDJSON (one packet per line) with Content-Type application/x-ndjson.
+    The body is read on the event loop; every BATCH_CHUNK_SIZE packets are validated and
+    upserted in the threadpool, so a large batch never stalls live streams or other requests.
+    Invalid packets are reported by index.
+    """
+    accepted = inserted = updated = 0
+    errors = []
+
+    async def flush(chunk: List[Any], first_index: int):
+        nonlocal accepted, inserted, updated
+        chunk_accepted, counts, chunk_errors = await run_in_threadpool(ingest_batch_chunk, chunk, first_index)
+        accepted += chunk_accepted
+        inserted += counts["inserted"]
+        updated += counts["updated"]
+        errors.extend(chunk_errors)
+
+    chunk = []
+    index = 0
+    try:
+        async for item in iter_batch_items(request):
+            if index >= MAX_BATCH_SIZE:
+                raise HTTPException(status_code=413, detail=f"Batch exceeds {MAX_BATCH_SIZE} packets")
+            chunk.append(item)
+            index += 1
+            if len(chunk) >= BATCH_CHUNK_SIZE:
+                await flush(chunk, index - len(chunk))
+                chunk = []
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON in batch: {e}")
+    if chunk:
+        await flush(chunk, index - len(chunk))
+
+    return {
+        "status": "success" if not errors else "partial",
+        "accepted": accepted,
+        "rejected": len(errors),
+        "inserted": inserted,
+        "updated": updated,
+        "total_devices": len(submitted_data),
+        "errors": errors
+    }
+
 @app.get("/heatmap", response_class=HTMLResponse)
 def heatmap_visualization():
     """World map heatmap visualization of device data"""
@@ -217,32 +456,149 @@ def backend_root():
     return HTMLResponse(content="<html><body><h3>Fluence Python Worker backend root. Use /data or /heatmap/data for JSON endpoints.</h3></body></html>")
 
 
+def parse_bbox(bbox: str):
+    """Parse 'min_lng,min_lat,max_lng,max_lat'"""
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be 'min_lng,min_lat,max_lng,max_lat'")
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lng <= 180 and -180 <= max_lng <= 180):
+        raise HTTPException(status_code=400, detail="bbox is outside valid coordinates")
+    return min_lng, min_lat, max_lng, max_lat
+
 @app.get("/heatmap/data")
-def heatmap_data():
-    """Return generated + submitted data as JSON for frontend heatmap."""
-    sample_data = [generate_device_data() for _ in range(30)]
-    all_data = sample_data + submitted_data
-
-    heatmap_data = []
-    for item in all_data:
-        heatmap_data.append({
-            "lat": item["location"]["latitude"],
-            "lng": item["location"]["longitude"],
-            "value": item["decibel"],
-            "device_id": item["device_id"],
-            "event": item["event"],
-            "timestamp": item["timestamp"],
-            "is_submitted": item in submitted_data,
-            "city": item.get("city")
-        })
+def heatmap_data(request: Request, bbox: Optional[str] = None, zoom: Optional[float] = Query(None, ge=0, le=22)):
+    """
+    Return submitted data (plus demo samples in demo mode) as JSON for frontend heatmap.
+    With `bbox` (min_lng,min_lat,max_lng,max_lat) and `zoom`, return pre-aggregated cells
+    for the viewport instead: each item is a cell with mean position, mean dB (`value`),
+    max dB and device count, so the payload depends on the viewport, not the fleet size.
+    With `Accept: application/vnd.echonet.columnar` the same data comes back as packed
+    columns; the raw (non-aggregated) binary form carries submitted devices only.
+    """
+    columnar = wants_columnar(request.headers.get("accept"))
+    if bbox is not None or zoom is not None:
+        viewport = parse_bbox(bbox) if bbox is not None else (-180.0, -90.0, 180.0, 90.0)
+        if columnar:
+            level, row_count, columns = heatmap_grid.query_columns(viewport, zoom if zoom is not None else 0)
+            return columnar_response(row_count, columns, heatmap_zoom=level)
+        level, cells = heatmap_grid.query(viewport, zoom if zoom is not None else 0)
+        return {
+            "mode": "aggregated",
+            "zoom": level,
+            "bbox": list(viewport),
+            "total": len(cells),
+            "submitted": len(submitted_data),
+            "data": cells,
+        }
+
+    if columnar:
+        row_count, columns = submitted_data.columns()
+        return columnar_response(row_count, columns)
+
+    submitted = submitted_data.values()
+    heatmap_data = sample_pool.heatmap_points + [heatmap_point(item, True) for item in submitted]
 
     return {
-        "total": len(all_data),
+        "total": len(heatmap_data),
         "submitted": len(submitted_data),
         "data": heatmap_data,
     }
 
 
+def stream_subscriber(bbox: Optional[str], cells: bool, zoom: Optional[float], buffer: Optional[int]) -> Subscriber:
+    return Subscriber(
+        asyncio.get_running_loop(),
+        bbox=parse_bbox(bbox) if bbox else None,
+        cell_zoom=heatmap_grid.level_for(zoom if zoom is not None else 0) if cells else None,
+        max_buffer=min(buffer or STREAM_MAX_BUFFER, STREAM_MAX_BUFFER),
+    )
+
+@app.get("/stream")
+async def stream_events(
+    request: Request,
+    bbox: Optional[str] = None,
+    cells: bool = False,
+    zoom: Optional[float] = Query(None, ge=0, le=22),
+    buffer: Optional[int] = Query(None, ge=1),
+):
+    """
+    Server-Sent Events feed of devices as they are ingested, optionally limited to `bbox`.
+    With `cells=true` (and `zoom`), sends heatmap cell deltas instead of devices.
+    Slow clients get only the newest event per device/cell, at most `buffer` of them queued.
+    """
+    subscriber = stream_hub.subscribe(stream_subscriber(bbox, cells, zoom, buffer))
+
+    async def events():
+        reported_drops = 0
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                batch = await subscriber.get(STREAM_KEEPALIVE_SECONDS)
+                if not batch:
+                    yield ": keepalive\n\n"
+                    continue
+                if subscriber.dropped != reported_drops:
+                    reported_drops = subscriber.dropped
+                    yield f"event: dropped\ndata: {json.dumps({'dropped': reported_drops})}\n\n"
+                yield "".join(f"event: {item['type']}\ndata: {json.dumps(item)}\n\n" for item in batch)
+        finally:
+            stream_hub.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/stream")
+async def stream_websocket(
+    websocket: WebSocket,
+    bbox: Optional[str] = None,
+    cells: bool = False,
+    zoom: Optional[float] = None,
+    buffer: Optional[int] = None,
+):
+    """
+    WebSocket form of /stream: each message is a JSON array of events.
+    Clients may send {"bbox": "min_lng,min_lat,max_lng,max_lat"} (or null) to move the filter.
+    """
+    try:
+        subscriber = stream_subscriber(bbox, cells, zoom, buffer)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
+    await websocket.accept()
+    stream_hub.subscribe(subscriber)
+
+    async def receive_filters():
+        while True:
+            message = await websocket.receive_json()
+            if isinstance(message, dict) and "bbox" in message:
+                try:
+                    subscriber.bbox = parse_bbox(message["bbox"]) if message["bbox"] else None
+                except HTTPException as e:
+                    await websocket.send_json({"type": "error", "detail": e.detail})
+
+    receiver = asyncio.create_task(receive_filters())
+    try:
+        reported_drops = 0
+        while True:
+            getter = asyncio.create_task(subscriber.get(STREAM_KEEPALIVE_SECONDS))
+            await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver.done():
+                # Client went away (or sent something unreadable)
+                getter.cancel()
+                break
+            batch = getter.result()
+            if subscriber.dropped != reported_drops:
+                reported_drops = subscriber.dropped
+                batch.insert(0, {"type": "dropped", "dropped": reported_drops})
+            if batch:
+                await websocket.send_json(batch)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        stream_hub.unsubscribe(subscriber)
+
 @app.get("/healthz")
 def health_check():
     """Simple health check for reverse-proxy and container orchestrators"""
@@ -253,4 +609,11 @@ if __name__ == "__main__":
     # Use PORT env var if provided so reverse-proxy or docker can map ports easily
     # Default to 5000 because the container listens on 5000 and docker-compose maps host 5001 -> container 5000
     port = int(os.environ.get("PORT", "5000"))
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+    if workers > 1 and shared_state is None:
+        print("⚠️  WEB_CONCURRENCY > 1 without SHARED_STATE_URL: each worker would see different data; using 1")
+        workers = 1
+    if workers > 1:
+        uvicorn.run("index:app", host="0.0.0.0", port=port, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
@@ -0,0 +1,135 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+BBox = Tuple[float, float, float, float]
+
+
+def in_bbox(bbox: Optional[BBox], latitude: float, longitude: float) -> bool:
+    if bbox is None:
+        return True
+    min_lng, min_lat, max_lng, max_lat = bbox
+    if not min_lat <= latitude <= max_lat:
+        return False
+    if min_lng <= max_lng:
+        return min_lng <= longitude <= max_lng
+    return longitude >= min_lng or longitude <= max_lng  # crosses the antimeridian
+
+
+class Subscriber:
+    """
+    One live-stream client. Events are keyed (device MAC or cell id) and coalesced, so a
+    slow client only ever receives the newest state of each key. The buffer holds at most
+    max_buffer keys; beyond that the oldest key is dropped and counted.
+
+    put() may be called from any thread and only wakes the client's event loop when the
+    buffer goes from empty to non-empty. Once that loop is closed the subscriber is marked
+    closed and ignores further events instead of failing the caller.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, bbox: Optional[BBox] = None,
+                 cell_zoom: Optional[int] = None, max_buffer: int = 1000):
+        self.bbox = bbox
+        self.cell_zoom = cell_zoom
+        self.max_buffer = max_buffer
+        self.dropped = 0
+        self.coalesced = 0
+        self._buffer: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loop = loop
+        self._ready = asyncio.Event()
+        self.closed = False
+
+    def put(self, key: str, event: Dict[str, Any]):
+        if self.closed:
+            return
+        with self._lock:
+            was_empty = not self._buffer
+            if key in self._buffer:
+                del self._buffer[key]
+                self.coalesced += 1
+            elif len(self._buffer) >= self.max_buffer:
+                self._buffer.popitem(last=False)
+                self.dropped += 1
+            self._buffer[key] = event
+        if was_empty:
+            try:
+                self._loop.call_soon_threadsafe(self._ready.set)
+            except RuntimeError:
+                # The client's loop is gone (disconnected during shutdown): never fail the ingest
+                self.closed = True
+
+    async def get(self, timeout: float) -> List[Dict[str, Any]]:
+        """Waits up to `timeout` seconds and returns every buffered event ([] on timeout)."""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        with self._lock:
+            self._ready.clear()
+            events = list(self._buffer.values())
+            self._buffer.clear()
+        return events
+
+
+class StreamHub:
+    """Fans ingested devices (and, for subscribers that ask, heatmap cell deltas) out to live clients."""
+
+    def __init__(self):
+        self._subscribers: List[Subscriber] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self, subscriber: Subscriber) -> Subscriber:
+        with self._lock:
+            # Copy-on-write so publish() can iterate without holding the lock
+            self._subscribers = self._subscribers + [subscriber]
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s is not subscriber]
+
+    def publish(self, device_data: Dict[str, Any], previous: Optional[Tuple[float, float, float]], grid=None):
+        """Called after an ingest; `previous` is the device's earlier (lat, lng, dB) in the grid."""
+        subscribers = self._subscribers
+        if not subscribers:
+            return
+        location = device_data.get("location") or {}
+        latitude, longitude = location.get("latitude"), location.get("longitude")
+        if latitude is None or longitude is None:
+            return
+        event = None
+        for subscriber in subscribers:
+            if subscriber.cell_zoom is not None and grid is not None:
+                points = [(latitude, longitude)]
+                if previous is not None and tuple(previous[:2]) != (latitude, longitude):
+                    points.append(previous[:2])
+                for lat, lng in points:
+                    if in_bbox(subscriber.bbox, lat, lng):
+                        key, cell = grid.cell_at(subscriber.cell_zoom, lat, lng)
+                        subscriber.put(key, {"type": "cell", "id": key, **cell})
+                continue
+            if not in_bbox(subscriber.bbox, latitude, longitude):
+                if previous is not None and in_bbox(subscriber.bbox, *previous[:2]):
+                    # The device moved out of view
+                    subscriber.put(device_data["mac_address"], {"type": "leave", "mac_address": device_data["mac_address"]})
+                continue
+            if event is None:
+                event = {
+                    "type": "device",
+                    "mac_address": device_data["mac_address"],
+                    "device_id": device_data.get("device_id"),
+                    "lat": latitude,
+                    "lng": longitude,
+                    "value": device_data.get("decibel"),
+                    "event": device_data.get("event"),
+                    "timestamp": device_data.get("timestamp"),
+                }
+            subscriber.put(device_data["mac_address"], event)
+        closed = [subscriber for subscriber in subscribers if subscriber.closed]
+        for subscriber in closed:
+            self.unsubscribe(subscriber)
@@ -0,0 +1,182 @@
+import json
+import os
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Set, Tuple
+
+import redis
+
+Record = Dict[str, Any]
+
+
+class RedisSharedState:
+    """
+    Latest device records shared between worker processes through Redis.
+
+    Redis holds one hash field per MAC address (the JSON record) and is the source of
+    truth; every worker keeps a full in-memory mirror so reads never leave the process.
+    Local writes are queued and sent by a publisher thread in pipelined batches, each
+    batch updating the hash and announcing the records on a pub/sub channel in one
+    transaction. A subscriber thread applies the announced batches.
+
+    Each MAC also has a version, bumped per sample in the same transaction as its record.
+    Announcements carry every sample with its version, not only the last, and records are
+    applied last-writer-wins on that version, so two workers writing one device at once
+    converge on whichever write Redis committed last.
+    A worker's own writes are already applied locally; their echoes are only re-applied
+    when another worker's older record landed on top of them meanwhile.
+    """
+
+    def __init__(self, url: str, key: str = "echonet:devices", channel: str = "echonet:devices:updates",
+                 batch_size: int = 500, retry_delay: float = 1.0):
+        self.client = redis.Redis.from_url(url)
+        self.key = key
+        self.versions_key = f"{key}:versions"
+        self.channel = channel
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        # Identifies this process's own announcements, which it has already applied
+        self.origin = f"{socket.gethostname()}:{os.getpid()}"
+        self._pending: List[Tuple[str, str]] = []
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._pubsub = None
+        self._threads: List[threading.Thread] = []
+        self._versions: Dict[str, int] = {}    # version of each record held locally (subscriber thread)
+        self._local: Dict[str, str] = {}       # latest local write per MAC not yet echoed back
+        self._overridden: Set[str] = set()     # MACs whose pending local write was overwritten by another worker
+        self._local_lock = threading.Lock()
+
+    def _subscribe(self):
+        if self._pubsub is not None:
+            self._pubsub.close()
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(self.channel)
+
+    def _load(self) -> Iterator[Tuple[int, Record]]:
+        # Versions are read first: a record written meanwhile then carries an older version
+        # and is applied again when its announcement arrives, never the other way round
+        versions = {mac.decode(): int(version) for mac, version in self.client.hscan_iter(self.versions_key, count=1000)}
+        for mac, value in self.client.hscan_iter(self.key, count=1000):
+            yield versions.get(mac.decode(), 0), json.loads(value)
+
+    def open(self) -> Iterator[Record]:
+        """Yields every shared record. Subscribes first so nothing published meanwhile is missed."""
+        self._subscribe()
+        for version, record in self._load():
+            self._versions[record["mac_address"]] = version
+            yield record
+
+    def append(self, record: Record):
+        line = json.dumps(record, separators=(",", ":"))
+        with self._local_lock:
+            self._local[record["mac_address"]] = line
+            self._overridden.discard(record["mac_address"])
+        with self._cond:
+            self._pending.append((record["mac_address"], line))
+            self._cond.notify()
+
+    def start(self, apply: Callable[[Record], None]):
+        """Starts publishing local writes and applying other workers' writes with `apply`."""
+        self._threads = [
+            threading.Thread(target=self._publish_loop, name="shared-state-publisher", daemon=True),
+            threading.Thread(target=self._subscribe_loop, args=(apply,), name="shared-state-subscriber", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _publish_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+            while True:
+                try:
+                    self._publish(batch)
+                    break
+                except redis.RedisError as e:
+                    print(f"⚠️  Shared state publish failed ({e}); retrying in {self.retry_delay}s")
+                    time.sleep(self.retry_delay)
+
+    def _publish(self, batch: List[Tuple[str, str]]):
+        # The hash keeps the last record per device, but every sample is announced so other
+        # workers feed the same readings into their history as the worker that ingested them
+        latest = dict(batch)
+        macs = list(latest)
+        with self.client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    # Versions are bumped optimistically: a concurrent batch from another worker retries this one
+                    pipe.watch(self.versions_key)
+                    current = pipe.hmget(self.versions_key, macs)
+                    versions = {mac: int(version or 0) for mac, version in zip(macs, current)}
+                    records = []
+                    for mac, line in batch:
+                        versions[mac] += 1
+                        records.append([versions[mac], line])
+                    pipe.multi()
+                    pipe.hset(self.key, mapping=latest)
+                    pipe.hset(self.versions_key, mapping=versions)
+                    pipe.publish(self.channel, json.dumps({"origin": self.origin, "records": records}))
+                    pipe.execute()
+                    return
+                except redis.WatchError:
+                    continue
+
+    def _receive(self, version: int, record: Record, line: str, own: bool, apply: Callable[[Record], None]):
+        mac = record["mac_address"]
+        applied = False
+        if version > self._versions.get(mac, 0):
+            self._versions[mac] = version
+            with self._local_lock:
+                # An echo of our own write only needs applying if another record replaced it locally
+                applied = not own or mac in self._overridden
+            if applied:
+                apply(record)
+        elif not own:
+            return
+        with self._local_lock:
+            pending = self._local.get(mac)
+            if own and pending == line:
+                del self._local[mac]
+                self._overridden.discard(mac)
+            elif applied and pending is not None:
+                # Checked after applying, so a local write that raced with it is re-applied on its echo
+                self._overridden.add(mac)
+
+    def _subscribe_loop(self, apply: Callable[[Record], None]):
+        while not self._stopped:
+            try:
+                for message in self._pubsub.listen():
+                    try:
+                        payload = json.loads(message["data"])
+                        own = payload["origin"] == self.origin
+                        for version, line in payload["records"]:
+                            self._receive(version, json.loads(line), line, own, apply)
+                    except Exception as e:
+                        print(f"⚠️  Skipping malformed shared state announcement: {e}")
+            except redis.RedisError as e:
+                if self._stopped:
+                    return
+                print(f"⚠️  Shared state subscription lost ({e}); resyncing in {self.retry_delay}s")
+                time.sleep(self.retry_delay)
+                try:
+                    # Announcements made while disconnected are gone: reload the hash instead
+                    self._subscribe()
+                    for version, record in self._load():
+                        self._receive(version, record, None, False, apply)
+                except redis.RedisError:
+                    continue
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._threads:
+            self._threads[0].join()
+        if self._pubsub is not None:
+            self._pubsub.close()
@@ -0,0 +1,227 @@
+import glob
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+Record = Dict[str, Any]
+# Given a rotate callback, returns the full current state; rotate runs while writes are blocked
+SnapshotSource = Callable[[Callable[[], None]], List[Record]]
+# Returns derived per-device history to snapshot alongside the records
+HistorySource = Callable[[], List[Record]]
+
+
+class MemoryStorage:
+    """No persistence: state lives only in the process, as before."""
+
+    def open(self) -> Iterator[Record]:
+        return iter(())
+
+    def open_history(self) -> Iterator[Record]:
+        return iter(())
+
+    def append(self, record: Record):
+        pass
+
+    def start(self, snapshot_source: SnapshotSource, history_source: Optional[HistorySource] = None):
+        pass
+
+    def close(self):
+        pass
+
+
+class LogStorage:
+    """
+    Append-only NDJSON log of device records plus a periodic snapshot.
+
+    Every upsert is written through to the OS as part of the upsert and fsynced in
+    batches every `fsync_interval` seconds, so a process crash loses nothing and a power
+    loss loses at most one interval. Once `compact_records` records have been logged
+    since the last snapshot, the full state is written to a new snapshot and older
+    segments are deleted, so startup replays at most one snapshot plus a bounded tail.
+
+    Given a history source, the derived per-device history is snapshotted at the same
+    point of the record stream, so loading it and replaying the log tail on top rebuilds
+    the history as well. A reading still being added to the history while the snapshot
+    is taken can be missing from it.
+
+    Files in `directory`:
+        snapshot.ndjson      header {"next_log": n}, then one record per line
+        history.ndjson       history records taken with the snapshot
+        log.<n>.ndjson       records appended after the snapshot, replayed in order
+    """
+
+    SNAPSHOT = "snapshot.ndjson"
+    HISTORY = "history.ndjson"
+
+    def __init__(self, directory: str, fsync_interval: float = 0.05, compact_records: int = 50000):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.compact_records = compact_records
+        self.generation = 0
+        self.since_snapshot = 0
+        self._file = None
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self._snapshot_source: Optional[SnapshotSource] = None
+        self._history_source: Optional[HistorySource] = None
+
+    def _log_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"log.{generation}.ndjson")
+
+    def _log_generations(self) -> List[int]:
+        generations = []
+        for path in glob.glob(os.path.join(self.directory, "log.*.ndjson")):
+            try:
+                generations.append(int(os.path.basename(path).split(".")[1]))
+            except ValueError:
+                continue
+        return sorted(generations)
+
+    @staticmethod
+    def _read_lines(path: str) -> Iterator[Record]:
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Torn write at the tail of a segment after a crash
+                    print(f"⚠️  Skipping unreadable record in {os.path.basename(path)}")
+
+    def open(self) -> Iterator[Record]:
+        """Yields the persisted records (snapshot first, then the log tail) and opens a new segment."""
+        os.makedirs(self.directory, exist_ok=True)
+        next_log = 0
+        snapshot_path = os.path.join(self.directory, self.SNAPSHOT)
+        if os.path.exists(snapshot_path):
+            lines = self._read_lines(snapshot_path)
+            header = next(lines, None) or {}
+            next_log = header.get("next_log", 0)
+            yield from lines
+
+        generations = [g for g in self._log_generations() if g >= next_log]
+        for generation in generations:
+            if os.path.getsize(self._log_path(generation)) == 0:
+                os.remove(self._log_path(generation))
+                continue
+            for record in self._read_lines(self._log_path(generation)):
+                self.since_snapshot += 1
+                yield record
+
+        # Never append behind a possibly torn tail: each start gets a fresh segment
+        self.generation = max(generations + [next_log - 1]) + 1
+        self._file = open(self._log_path(self.generation), "a", encoding="utf-8")
+
+    def open_history(self) -> Iterator[Record]:
+        """Yields the history records taken with the current snapshot, if any."""
+        history_path = os.path.join(self.directory, self.HISTORY)
+        if os.path.exists(history_path):
+            yield from self._read_lines(history_path)
+
+    def append(self, record: Record):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            # Hand the line to the OS now, so only a power loss can take it; fsync stays batched
+            self._file.flush()
+            self._dirty = True
+            self.since_snapshot += 1
+
+    def start(self, snapshot_source: SnapshotSource, history_source: Optional[HistorySource] = None):
+        self._snapshot_source = snapshot_source
+        self._history_source = history_source
+        self._flusher = threading.Thread(target=self._run, name="storage-flusher", daemon=True)
+        self._flusher.start()
+
+    def _sync(self):
+        # Caller holds _lock
+        if self._dirty and self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._dirty = False
+
+    def _run(self):
+        while not self._stop.wait(self.fsync_interval):
+            try:
+                with self._lock:
+                    self._sync()
+                if self.since_snapshot >= self.compact_records:
+                    self.compact()
+            except Exception as e:
+                # Keep the flusher alive: the records stay dirty and are retried next interval
+                print(f"⚠️  Storage flush failed ({e}); retrying in {self.fsync_interval}s")
+
+    def _rotate(self):
+        # Called by the snapshot source while it blocks writers, so the snapshot and the
+        # new segment split the record stream at exactly the same point
+        with self._lock:
+            self._sync()
+            self._file.close()
+            self.generation += 1
+            self._file = open(self._log_path(self.generation), "a", encoding="utf-8")
+            self.since_snapshot = 0
+
+    def compact(self):
+        """Writes a snapshot of the current state and drops the log segments it covers."""
+        started = time.time()
+        history: List[Record] = []
+
+        def rotate():
+            self._rotate()
+            if self._history_source is not None:
+                history[:] = self._history_source()
+
+        records = self._snapshot_source(rotate)
+        next_log = self.generation
+        # History first: if the snapshot is not replaced, the old log is replayed onto it and
+        # its older readings are dropped as out of order, rather than leaving a gap
+        if self._history_source is not None:
+            self._write_atomically(self.HISTORY, history)
+        self._write_atomically(self.SNAPSHOT, [{"next_log": next_log}] + records)
+        dir_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        for generation in self._log_generations():
+            if generation < next_log:
+                os.remove(self._log_path(generation))
+        print(f"🗜️  Storage compacted {len(records)} records in {time.time() - started:.2f}s")
+
+    def _write_atomically(self, name: str, records: List[Record]):
+        path = os.path.join(self.directory, name)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def close(self):
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+
+
+def storage_from_env() -> Union[MemoryStorage, LogStorage]:
+    backend = os.environ.get("STORAGE_BACKEND", "log").lower()
+    if backend == "memory":
+        return MemoryStorage()
+    if backend != "log":
+        raise ValueError(f"Unknown STORAGE_BACKEND '{backend}' (expected 'log' or 'memory')")
+    return LogStorage(
+        os.environ.get("STORAGE_DIR", "data"),
+        fsync_interval=float(os.environ.get("STORAGE_FSYNC_INTERVAL", "0.05")),
+        compact_records=int(os.environ.get("STORAGE_COMPACT_RECORDS", "50000")),
+    )
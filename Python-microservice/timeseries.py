@@ -0,0 +1,215 @@
+import math
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Optional
+
+
+class RingColumns:
+    """
+    Fixed-capacity ring of parallel packed columns (one array per field).
+
+    Rows are appended in time order; columns grow until `capacity` and then the oldest
+    row is overwritten. Column 0 is the timestamp and must be non-decreasing so ranges
+    can be bisected.
+    """
+
+    def __init__(self, capacity: int, typecodes: str):
+        self.capacity = capacity
+        self.columns = [array(code) for code in typecodes]
+        self.start = 0
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _slot(self, i: int) -> int:
+        return (self.start + i) % self.capacity
+
+    def append(self, *values):
+        if self.size < self.capacity:
+            for column, value in zip(self.columns, values):
+                column.append(value)
+            self.size += 1
+            return
+        slot = self.start
+        self.start = (self.start + 1) % self.capacity
+        for column, value in zip(self.columns, values):
+            column[slot] = value
+
+    def last(self, field: int = 0):
+        return self.columns[field][self._slot(self.size - 1)] if self.size else None
+
+    def last_row(self) -> tuple:
+        slot = self._slot(self.size - 1)
+        return tuple(column[slot] for column in self.columns)
+
+    def set_last(self, *values):
+        slot = self._slot(self.size - 1)
+        for column, value in zip(self.columns, values):
+            column[slot] = value
+
+    def first_time(self) -> Optional[float]:
+        return self.columns[0][self.start] if self.size else None
+
+    def _ordered(self, column: array) -> array:
+        # Unrolls the ring into time order; a slice copy of packed data, no per-row objects
+        end = self.start + self.size
+        if end <= self.capacity:
+            return column[self.start:end]
+        return column[self.start:] + column[:end - self.capacity]
+
+    def rows(self) -> List[list]:
+        """Every column in time order, as plain lists."""
+        return [self._ordered(column).tolist() for column in self.columns]
+
+    def load(self, columns: List[list]):
+        """Appends rows given column-wise (as from rows()); only the newest `capacity` are kept."""
+        for row in zip(*columns):
+            self.append(*row)
+
+    def range(self, start_time: float, end_time: float) -> List[array]:
+        """Returns the columns for rows with start_time <= t <= end_time."""
+        times = self._ordered(self.columns[0])
+        lo, hi = bisect_left(times, start_time), bisect_right(times, end_time)
+        return [times[lo:hi]] + [self._ordered(column)[lo:hi] for column in self.columns[1:]]
+
+
+class DeviceSeries:
+    """Raw readings plus 1-minute and 1-hour min/max/sum/count roll-ups for one device."""
+
+    def __init__(self, raw_capacity: int, rollup_capacities: Dict[int, int]):
+        # Raw: timestamp (float64), decibel (float32)
+        self.raw = RingColumns(raw_capacity, "df")
+        # Roll-ups: bucket start, min, max, sum, count
+        self.rollups = {width: RingColumns(capacity, "dffdI") for width, capacity in rollup_capacities.items()}
+
+    def append(self, timestamp: float, decibel: float, replayed: bool = False) -> bool:
+        last = self.raw.last()
+        if last is not None and timestamp < last:
+            return False
+        if replayed and timestamp == last and self.raw.last(1) == array("f", [decibel])[0]:
+            # Already in the restored history
+            return False
+        self.raw.append(timestamp, decibel)
+        for width, ring in self.rollups.items():
+            bucket = math.floor(timestamp / width) * width
+            if ring.last() == bucket:
+                _, lo, hi, total, count = ring.last_row()
+                ring.set_last(bucket, min(lo, decibel), max(hi, decibel), total + decibel, count + 1)
+            else:
+                ring.append(bucket, decibel, decibel, decibel, 1)
+        return True
+
+
+class SeriesStore:
+    """
+    Per-device time series kept in compact columnar ring buffers.
+
+    Retention is set per resolution: raw_capacity readings per device, and a number of
+    1-minute and 1-hour buckets. Queries read the coarsest resolution that is no coarser
+    than the requested step and still covers the requested start time.
+
+    The buffers live in memory; dump() and load() let the storage layer snapshot them
+    next to the device records so history survives a restart.
+    """
+
+    MINUTE = 60
+    HOUR = 3600
+
+    def __init__(self, raw_capacity: int = 1000, minute_capacity: int = 1440, hour_capacity: int = 24 * 30):
+        self.raw_capacity = raw_capacity
+        self.rollup_capacities = {self.MINUTE: minute_capacity, self.HOUR: hour_capacity}
+        self.series: Dict[str, DeviceSeries] = {}
+        self.out_of_order = 0
+        self._lock = threading.Lock()
+
+    def record(self, mac_address: str, timestamp: float, decibel: float, replayed: bool = False) -> bool:
+        """
+        Appends a reading. Readings older than the device's newest one are dropped, and so
+        are `replayed` ones identical to it, which the restored history already holds.
+        """
+        with self._lock:
+            series = self.series.get(mac_address)
+            if series is None:
+                series = self.series[mac_address] = DeviceSeries(self.raw_capacity, self.rollup_capacities)
+            accepted = series.append(timestamp, float(decibel), replayed)
+            if not accepted and not replayed:
+                self.out_of_order += 1
+            return accepted
+
+    def dump(self) -> List[dict]:
+        """One record per device with every resolution's columns, for load()."""
+        with self._lock:
+            return [
+                {"mac_address": mac_address, "raw": series.raw.rows(),
+                 "rollups": {str(width): ring.rows() for width, ring in series.rollups.items()}}
+                for mac_address, series in self.series.items()
+            ]
+
+    def load(self, records: Iterable[dict]):
+        """Restores series from dump() records; resolutions no longer configured are skipped."""
+        with self._lock:
+            for record in records:
+                series = self.series[record["mac_address"]] = DeviceSeries(self.raw_capacity, self.rollup_capacities)
+                series.raw.load(record["raw"])
+                for width, columns in record["rollups"].items():
+                    ring = series.rollups.get(int(width))
+                    if ring is not None:
+                        ring.load(columns)
+
+    def __contains__(self, mac_address: str) -> bool:
+        return mac_address in self.series
+
+    def choose_resolution(self, series: DeviceSeries, start_time: float, step: float) -> int:
+        """0 means raw readings, otherwise the roll-up bucket width in seconds."""
+        candidates = [0] + sorted(series.rollups)
+        usable = [width for width in candidates if width <= step] or [0]
+        for width in reversed(usable):
+            ring = series.raw if width == 0 else series.rollups[width]
+            first = ring.first_time()
+            if first is not None and first <= start_time:
+                return width
+        # Nothing reaches back far enough: never go coarser than `step`, just return a truncated
+        # range from whichever usable resolution reaches furthest back (finer on ties)
+        best, best_first = 0, None
+        for width in usable:
+            ring = series.raw if width == 0 else series.rollups[width]
+            first = ring.first_time()
+            if first is not None and (best_first is None or first < best_first):
+                best, best_first = width, first
+        return best
+
+    def query(self, mac_address: str, start_time: float, end_time: float, step: float) -> Optional[dict]:
+        """Returns {"resolution": seconds, "points": [...]} with points bucketed by `step` seconds."""
+        with self._lock:
+            series = self.series.get(mac_address)
+            if series is None:
+                return None
+            resolution = self.choose_resolution(series, start_time, step)
+            if resolution == 0:
+                times, decibels = series.raw.range(start_time, end_time)
+                columns = (times, decibels, decibels, decibels, None)
+            else:
+                # Include the bucket that straddles start_time
+                bucket_start = math.floor(start_time / resolution) * resolution
+                columns = series.rollups[resolution].range(bucket_start, end_time)
+
+        times, mins, maxs, sums, counts = columns
+        points = []
+        current = None
+        for i in range(len(times)):
+            bucket = math.floor(times[i] / step) * step
+            count = counts[i] if counts is not None else 1
+            if current is None or current["t"] != bucket:
+                current = {"t": bucket, "min": mins[i], "max": maxs[i], "sum": sums[i], "count": count}
+                points.append(current)
+            else:
+                current["min"] = min(current["min"], mins[i])
+                current["max"] = max(current["max"], maxs[i])
+                current["sum"] += sums[i]
+                current["count"] += count
+        for point in points:
+            point["mean"] = round(point.pop("sum") / point["count"], 2)
+            point["min"], point["max"] = round(point["min"], 2), round(point["max"], 2)
+        return {"resolution": resolution, "points": points}